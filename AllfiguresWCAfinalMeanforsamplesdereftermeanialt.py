@@ -1,4 +1,3 @@
-import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 from scipy.stats import ttest_ind
@@ -6,6 +5,8 @@ from itertools import combinations
 from uncertainties import ufloat
 from uncertainties.umath import *  # This allows for mathematical operations on ufloats
 
+from ExcelLoader import read_excel
+
 # Function to add statistical annotation
 def add_stat_annotation(ax, p_val, x1, x2, y, h, significance_thresholds, already_annotated):
     if p_val < significance_thresholds[0]:
@@ -59,7 +60,7 @@ all_data = []  # To store the raw data for t-tests, including the differences
 for i, file_path in enumerate(file_paths):
     
     # Load the data, only columns B-F (which corresponds to Excel columns 1 to 5, since it's 0-indexed)
-    data = pd.read_excel(file_path, skiprows=2, usecols='B:F')
+    data = read_excel(file_path, skiprows=2, usecols='B:F')
 
     
     # Extract columns Mean_adv, Mean_rec, std_adv, std_rec
@@ -0,0 +1,337 @@
+# -*- coding: utf-8 -*-
+'''
+Unattended version of AnalyseAfPitsCellebilleder.py for many samples at once.
+
+The script reads a manifest (a CSV file) with one line per sample:
+
+    sample_folder,master
+    Your cell data/Imprints(PCmedTI)/dag_5/_Dag_5_sample_2_/,W
+    Your cell data/Imprints(PCmedTI)/dag_5/_Dag_5_sample_3_/,M7
+
+An optional 'day' column chooses the cell area parameters for that day (see
+cell_area_parameters_per_day in PitsCellebilleder.py).
+
+An optional 'calibration' column can point to a calibration file. If it is left
+out, the file 'Zbehandlet - Kalibrering.json' in the sample folder is used. This
+file is written by RotationAfCellebilleder.py (the two rotation corners) and by
+AnalyseAfPitsCellebilleder.py (the three field corners and their field numbers).
+If no field corners are saved, the fields are found automatically in the
+rotated BF image (see auto_calibrate_grid in PitsCellebilleder.py). Samples where
+the automatic fit is worse than max_residual pixels fail instead of being counted.
+
+For every sample the BF and UV images are rotated (only if the rotated images are
+not already in the sample folder, see rotate_sample in BatchRotationAfCellebilleder.py,
+which estimates the angle if no rotation corners are saved), the fields are laid
+out, the cells are counted and the counts are written to CellCountData.xlsx in the
+sample folder, or with store_path to the results store (see ResultsStore.py), from
+which one Excel report is made at the end. All 64 fields are kept. With fused=True
+the rotated images are not written at all and only the fields are rotated, see
+count_sample_fused. Samples are processed in parallel, see run_batch. A sample
+that fails is reported at the end and does not stop the other samples.
+'''
+
+import csv
+import os
+from functools import partial
+
+import cv2
+
+from PitsCellebilleder import (master_dictionary, BF_image_name, UV_image_name, rotated_BF_image_name,
+                               rotated_UV_image_name, calibration_file_name, load_calibration, save_calibration,
+                               rotation_matrix_for_image, count_cells_in_rotated_fields,
+                               calculate_all_corners, auto_calibrate_grid,
+                               calculate_square_size, cell_area_parameters, count_cells_in_fields,
+                               count_cells_single_pass, change_orientation, write_cell_count_workbook,
+                               read_UV_image, lattice_from_edge_profiles)
+from BatchRotationAfCellebilleder import rotate_sample, sample_rotation_degree
+from ParallelCellCounting import count_cells_in_fields_parallel
+from TiledImage import edge_profiles, count_cells_in_fields_tiled
+from ResultsStore import results_store_name, sample_rows, save_sample, export_report
+from BatchRunner import run_jobs
+
+# Channel of the rotated UV image holding the UV signal, used when counting in grayscale
+UV_channel = 0
+
+
+def read_manifest(manifest_path):
+    '''
+    Reads the manifest and returns a list of dictionaries, one for each sample.
+    Empty lines and lines starting with '#' are skipped.
+    '''
+    samples = []
+    with open(manifest_path, newline='', encoding='utf-8-sig') as f:
+        rows = [row for row in f if row.strip() and not row.startswith('#')]
+    for row in csv.DictReader(rows):
+        row = {key.strip(): (value or '').strip() for key, value in row.items()}
+        if not row.get('sample_folder') or not row.get('master'):
+            raise ValueError(f'Every line in the manifest needs a sample_folder and a master: {row}')
+        row['day'] = int(row['day']) if row.get('day') else None
+        samples.append(row)
+    return samples
+
+def load_sample_calibration(sample_path, calibration_path=None):
+    '''
+    Loads the calibration of a sample. Without a calibration_path the calibration
+    file in the sample folder is used, and if it does not exist an empty
+    calibration is returned.
+    '''
+    if calibration_path:
+        return load_calibration(calibration_path)
+    calibration_path = os.path.join(sample_path, calibration_file_name)
+    return load_calibration(calibration_path) if os.path.exists(calibration_path) else {}
+
+def sample_fields(sample_path, calibration, max_residual=5, tiled=False, BF_image=None):
+    '''
+    Returns the top left corner of all fields and the field size of a rotated sample,
+    from the saved corners or from the automatic calibration. With tiled the BF image
+    is streamed through for the automatic calibration instead of being loaded.
+    A rotated BF_image already in memory is used instead of the one in the sample folder.
+    '''
+    # Calibration, the same calculation as in AnalyseAfPitsCellebilleder.py
+    if 'corners' in calibration:
+        all_corners, felt_plus_inter_pixels_x, felt_plus_inter_pixels_y = calculate_all_corners(
+            calibration['corners'], calibration['valgt_felt'], calibration['kali_1'], calibration['kali_2'])
+    else:
+        BF_file_path = os.path.join(sample_path, rotated_BF_image_name)
+        if BF_image is not None:
+            all_corners, felt_plus_inter_pixels_x, felt_plus_inter_pixels_y, residual = auto_calibrate_grid(BF_image)
+        elif tiled:
+            all_corners, felt_plus_inter_pixels_x, felt_plus_inter_pixels_y, residual = lattice_from_edge_profiles(
+                *edge_profiles(BF_file_path))
+        else:
+            BF_image = cv2.imread(BF_file_path, cv2.IMREAD_GRAYSCALE)
+            if BF_image is None:
+                raise FileNotFoundError('Error loading base_image')
+            all_corners, felt_plus_inter_pixels_x, felt_plus_inter_pixels_y, residual = auto_calibrate_grid(BF_image)
+        if residual > max_residual:
+            raise ValueError(f'Automatic calibration failed, the residual is {residual:.1f} pixels')
+        print(f'The fields were found automatically with a residual of {residual:.1f} pixels')
+    square_size = calculate_square_size(felt_plus_inter_pixels_x, felt_plus_inter_pixels_y)
+    return all_corners, square_size
+
+def count_sample(sample_path, calibration, parameters, max_residual=5, field_workers=1, single_pass=False,
+                 grayscale=False, tiled=False):
+    '''
+    Rotates a sample (if the rotated images are missing) and counts the cells in the
+    rotated UV image. The options are described in process_sample.
+
+    Returns:
+    dict: The top left corner of each field as key and the cell count as value.
+    '''
+    rotate_sample(sample_path, calibration)
+    all_corners, square_size = sample_fields(sample_path, calibration, max_residual, tiled)
+
+    UV_file_path = os.path.join(sample_path, rotated_UV_image_name)
+    if tiled:
+        return count_cells_in_fields_tiled(UV_file_path, all_corners, square_size, parameters=parameters,
+                                           grayscale=grayscale, channel=UV_channel)
+
+    UV_image = read_UV_image(UV_file_path, grayscale, UV_channel)
+    if UV_image is None:
+        raise FileNotFoundError('Error: UV image was not succesfully loaded')
+    if single_pass:
+        return count_cells_single_pass(UV_image, all_corners, square_size, parameters=parameters)
+    if field_workers > 1:
+        return count_cells_in_fields_parallel(UV_image, all_corners, square_size, parameters=parameters,
+                                              workers=field_workers)
+    return count_cells_in_fields(UV_image, all_corners, square_size, parameters=parameters)
+
+def count_sample_fused(sample_path, calibration, parameters, max_residual=5, grayscale=False, save=True):
+    '''
+    Counts the cells of a sample straight from BF.tif and UV.tif, without writing
+    and reading back the rotated images. Only the 64 fields of the UV image are
+    rotated (see count_cells_in_rotated_fields in PitsCellebilleder.py). The rotated
+    BF image is only made, in memory, if the fields have to be found automatically.
+    The rotation angle is saved in the calibration file like in rotate_sample,
+    unless save is False.
+
+    Returns:
+    dict: The top left corner of each field as key and the cell count as value.
+    '''
+    BF_image = cv2.imread(os.path.join(sample_path, BF_image_name))
+    if BF_image is None:
+        raise FileNotFoundError(f'Error loading {os.path.join(sample_path, BF_image_name)}')
+    rotation_degree, method = sample_rotation_degree(calibration, BF_image)
+    rotation_matrix, size = rotation_matrix_for_image(rotation_degree, BF_image.shape)
+    if 'rotation_region' in calibration:
+        # Saved field corners are relative to the cropped rotated images
+        x, y, width, height = calibration['rotation_region']
+        rotation_matrix[:, 2] -= (x, y)
+        size = (width, height)
+
+    rotated_BF_image = None
+    if 'corners' not in calibration:
+        rotated_BF_image = cv2.warpAffine(cv2.cvtColor(BF_image, cv2.COLOR_BGR2GRAY), rotation_matrix, size)
+    del BF_image
+    all_corners, square_size = sample_fields(sample_path, calibration, max_residual, BF_image=rotated_BF_image)
+    if save:
+        save_calibration(os.path.join(sample_path, calibration_file_name), verbose=False,
+                         rotation_degree=rotation_degree, rotation_method=method)
+
+    UV_image = read_UV_image(os.path.join(sample_path, UV_image_name), grayscale, UV_channel)
+    if UV_image is None:
+        raise FileNotFoundError('Error: UV image was not succesfully loaded')
+    return count_cells_in_rotated_fields(UV_image, rotation_matrix, all_corners, square_size, parameters=parameters)
+
+def process_sample(path, sample_folder, master, calibration_path=None, max_residual=5, field_workers=1,
+                   single_pass=False, day=None, grayscale=False, tiled=False, fused=False, store_path=None):
+    '''
+    Rotates, counts and exports a single sample. Returns the path of the Excel file,
+    or of the results store if store_path is given (see ResultsStore.py).
+    With field_workers above 1 the fields are counted in that many processes.
+    With single_pass the UV image is segmented once instead of once per field,
+    see count_cells_single_pass in PitsCellebilleder.py. day chooses the cell area
+    parameters. With grayscale only the UV band is loaded and thresholded directly,
+    see compare_grayscale_with_hsv before using it on a new kind of images.
+    With tiled only the 64 fields of the UV image are read from the file, so large
+    scans can be counted without holding the full images in memory (the rotation,
+    if it is needed, still loads the full images).
+    With fused the rotated images are not written, see count_sample_fused.
+    '''
+    sample_path = os.path.join(path, sample_folder)
+    calibration = load_sample_calibration(sample_path, calibration_path)
+
+    orientering = master_dictionary.get(master)
+    if orientering is None:
+        raise ValueError(f'Master {master} is not in master_dictionary')
+
+    # Cell counting
+    parameters = cell_area_parameters(day)
+    if fused:
+        if tiled or single_pass or field_workers > 1:
+            raise ValueError('fused can not be combined with tiled, single_pass or field_workers')
+        cell_counts = count_sample_fused(sample_path, calibration, parameters, max_residual, grayscale)
+    else:
+        cell_counts = count_sample(sample_path, calibration, parameters, max_residual, field_workers,
+                                   single_pass, grayscale, tiled)
+
+    # Data extraction, all fields are kept
+    cell_count_matching = change_orientation(orientering, cell_counts)
+    sample_name = os.path.basename(os.path.normpath(sample_path))
+    if store_path is not None:
+        # The calibration is read again, as counting can have added the rotation angle
+        calibration = load_sample_calibration(sample_path, calibration_path)
+        return save_sample(store_path, sample_rows(sample_name, sample_folder, cell_count_matching, day, master,
+                                                   orientering, parameters, calibration))
+    new_file_path = os.path.join(sample_path, 'CellCountData.xlsx')
+    write_cell_count_workbook(os.path.join(path, 'CellCountDataSkabelon.xlsx'), new_file_path,
+                              sample_name, cell_count_matching)
+    return new_file_path
+
+def _process_manifest_sample(path, sample, **kwargs):
+    '''
+    process_sample for a line of the manifest, used as the job of run_batch.
+    '''
+    return process_sample(path, sample['sample_folder'], sample['master'], sample.get('calibration'),
+                          day=sample['day'], **kwargs)
+
+def run_batch(path, manifest_path, workers=1, field_workers=1, single_pass=False, grayscale=False,
+              tiled=False, fused=False, store_path=None, report_path=None):
+    '''
+    Processes every sample in the manifest. Returns a list of (sample_folder, error)
+    for the samples that failed.
+
+    With store_path the counts are saved in the results store instead of an Excel
+    file per sample, and with report_path the Excel report of the store is written
+    when all samples are done (see export_report in ResultsStore.py).
+
+    With workers above 1 that many samples are processed at the same time, each in
+    its own process. This keeps all cores busy on a large batch. field_workers is
+    for few but large samples and splits the fields of one sample over processes.
+    Use one or the other, not both. single_pass, grayscale, tiled and fused are
+    passed on to process_sample.
+    '''
+    samples = read_manifest(manifest_path)
+    job = partial(_process_manifest_sample, path, field_workers=field_workers if workers <= 1 else 1,
+                  single_pass=single_pass, grayscale=grayscale, tiled=tiled, fused=fused, store_path=store_path)
+    _, failed = run_jobs(job, samples, workers, name=lambda sample: sample['sample_folder'],
+                         describe=lambda new_file_path: f'saved to {new_file_path}', what='samples')
+
+    if store_path is not None and report_path is not None:
+        export_report(store_path, report_path)
+    return failed
+
+def compare_grayscale_with_hsv(path, manifest_path):
+    '''
+    Counts every sample in the manifest both with the HSV threshold and with the
+    grayscale threshold on the UV band and prints the difference, so the fast
+    grayscale path can be checked on a reference set before it is used.
+    The samples must already be rotated. Returns a list of
+    (sample_folder, HSV total, grayscale total, largest difference in a field).
+    '''
+    differences = []
+    for sample in read_manifest(manifest_path):
+        sample_path = os.path.join(path, sample['sample_folder'])
+        all_corners, square_size = sample_fields(sample_path, load_sample_calibration(sample_path, sample.get('calibration')))
+        parameters = cell_area_parameters(sample['day'])
+        UV_file_path = os.path.join(sample_path, rotated_UV_image_name)
+
+        counts_hsv = count_cells_in_fields(read_UV_image(UV_file_path), all_corners, square_size,
+                                           parameters=parameters)
+        counts_gray = count_cells_in_fields(read_UV_image(UV_file_path, True, UV_channel), all_corners,
+                                            square_size, parameters=parameters)
+
+        total_hsv = sum(counts_hsv.values())
+        total_gray = sum(counts_gray.values())
+        largest = max(abs(counts_hsv[corner] - counts_gray[corner]) for corner in all_corners)
+        print(f"{sample['sample_folder']}: HSV {total_hsv}, grayscale {total_gray}, "
+              f"difference {total_gray - total_hsv}, largest difference in a field {largest}")
+        differences.append((sample['sample_folder'], total_hsv, total_gray, largest))
+    return differences
+
+def compare_fused_with_rotated(path, manifest_path, max_difference=1):
+    '''
+    Counts every sample in the manifest both from the saved rotated UV image and
+    with count_sample_fused and prints the difference, so fused=True can be checked
+    on a reference set before it is used. The samples must already be rotated, and
+    the calibration files are not changed.
+
+    The fused fields are only equivalent to the rotated image up to interpolation
+    rounding (pixels can differ by 1), so a cell right at the threshold can change
+    the count of a field. Fields differing by up to max_difference are accepted,
+    a sample with a larger difference in a field is marked as not matching.
+    Returns a list of (sample_folder, rotated total, fused total, largest difference
+    in a field, matches).
+    '''
+    differences = []
+    for sample in read_manifest(manifest_path):
+        sample_path = os.path.join(path, sample['sample_folder'])
+        calibration = load_sample_calibration(sample_path, sample.get('calibration'))
+        all_corners, square_size = sample_fields(sample_path, calibration)
+        parameters = cell_area_parameters(sample['day'])
+
+        counts_rotated = count_cells_in_fields(read_UV_image(os.path.join(sample_path, rotated_UV_image_name)),
+                                               all_corners, square_size, parameters=parameters)
+        counts_fused = count_sample_fused(sample_path, calibration, parameters, save=False)
+
+        # Both are in the order of the fields
+        total_rotated = sum(counts_rotated.values())
+        total_fused = sum(counts_fused.values())
+        largest = max(abs(rotated - fused) for rotated, fused in zip(counts_rotated.values(), counts_fused.values()))
+        matches = largest <= max_difference
+        print(f"{sample['sample_folder']}: rotated {total_rotated}, fused {total_fused}, "
+              f"difference {total_fused - total_rotated}, largest difference in a field {largest}"
+              + ('' if matches else ' - does not match'))
+        differences.append((sample['sample_folder'], total_rotated, total_fused, largest, matches))
+    return differences
+
+# Example usage
+if __name__ == "__main__":
+    # This path should be the same as in AnalyseAfPitsCellebilleder.py, the sample folders
+    # in the manifest are relative to it
+    path = 'C:/Users/User/Desktop/Andreas script - Data folder/Andreas script - Data folder/'
+    manifest_path = path + 'Manifest.csv'
+
+    # Remove # to check the grayscale threshold against the HSV threshold before using grayscale=True
+    # compare_grayscale_with_hsv(path, manifest_path)
+    # Remove # to check fused=True against counting the saved rotated images
+    # compare_fused_with_rotated(path, manifest_path)
+
+    # Number of samples processed at the same time, os.cpu_count() uses every core
+    workers = os.cpu_count()
+
+    # Set to None to write a CellCountData.xlsx in every sample folder instead of using the results store
+    store_path = path + results_store_name
+    report_path = path + 'CellCountData rapport.xlsx'
+
+    run_batch(path, manifest_path, workers=workers, store_path=store_path, report_path=report_path)
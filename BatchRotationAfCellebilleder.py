@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+'''
+Unattended version of RotationAfCellebilleder.py for many samples at once.
+
+Every folder below path holding a BF.tif is a sample folder. The rotation angle of
+a sample is taken from the two rotation corners if they were clicked in
+RotationAfCellebilleder.py, otherwise it is estimated from the fields in the BF
+image (see estimate_rotation_degree in PitsCellebilleder.py). BF.tif and UV.tif
+are rotated by the same angle and saved as 'Zbehandlet - Rotated BF image.tif' and
+'Zbehandlet - Rotated UV image.tif'. The angle and how it was found are saved in
+'Zbehandlet - Kalibrering.json' in the sample folder, so it can be checked and
+reused later.
+
+With crop_to_fields only the part of the rotated images around the 64 fields is
+calculated and saved, which is faster and gives smaller files. The region is saved
+as 'rotation_region' in the calibration file, and field corners found or clicked
+afterwards are relative to the cropped images. With pyramid the rotated images are
+saved as pyramid TIFF files, see write_image in TiledImage.py.
+
+Samples are rotated in parallel, see run_batch_rotation. A sample that fails is
+reported at the end and does not stop the other samples.
+'''
+
+import os
+from functools import partial
+
+import cv2
+
+from PitsCellebilleder import (BF_image_name, UV_image_name, rotated_BF_image_name, rotated_UV_image_name,
+                               calibration_file_name, load_calibration, save_calibration,
+                               rotation_degree_from_corners, estimate_rotation_degree, rotate_channels,
+                               rotation_matrix_for_image, calculate_all_corners, auto_calibrate_grid,
+                               calculate_square_size, fields_region)
+from TiledImage import write_image
+from BatchRunner import run_jobs
+
+# The images that are rotated in every sample folder and the names of the rotated images.
+# More channels (e.g. Green Ex) can be added, they are rotated with the same rotation matrix
+channels = [(BF_image_name, rotated_BF_image_name), (UV_image_name, rotated_UV_image_name)]
+
+
+def find_sample_folders(path):
+    '''
+    Returns every folder below path (path included) with a BF image, sorted.
+    '''
+    return sorted(folder for folder, _, files in os.walk(path) if BF_image_name in files)
+
+def sample_rotation_degree(calibration, BF_image):
+    '''
+    Returns the rotation angle of a sample and how it was found. Clicked rotation
+    corners are used before a saved angle, and the angle is only estimated from the
+    BF image if neither is saved.
+
+    Returns:
+    tuple: (rotation_degree, method)
+    '''
+    if 'rotation_corners' in calibration:
+        return rotation_degree_from_corners(calibration['rotation_corners']), 'corners'
+    if 'rotation_degree' in calibration:
+        return calibration['rotation_degree'], calibration.get('rotation_method', 'saved')
+    return estimate_rotation_degree(BF_image), 'automatic'
+
+def sample_fields_region(calibration, BF_image, rotation_degree, max_residual=5):
+    '''
+    Returns the region (x, y, width, height) of the rotated image covering the fields,
+    see fields_region in PitsCellebilleder.py. The fields are taken from the saved
+    field corners, or found automatically in a grayscale rotation of the BF image.
+    '''
+    rotation_matrix, size = rotation_matrix_for_image(rotation_degree, BF_image.shape)
+    if 'corners' in calibration:
+        all_corners, felt_plus_inter_pixels_x, felt_plus_inter_pixels_y = calculate_all_corners(
+            calibration['corners'], calibration['valgt_felt'], calibration['kali_1'], calibration['kali_2'])
+    else:
+        rotated_BF_image = cv2.warpAffine(cv2.cvtColor(BF_image, cv2.COLOR_BGR2GRAY), rotation_matrix, size)
+        all_corners, felt_plus_inter_pixels_x, felt_plus_inter_pixels_y, residual = auto_calibrate_grid(rotated_BF_image)
+        if residual > max_residual:
+            raise ValueError(f'The fields could not be found for cropping, the residual is {residual:.1f} pixels')
+    return fields_region(all_corners, calculate_square_size(felt_plus_inter_pixels_x, felt_plus_inter_pixels_y), size)
+
+def rotate_sample(sample_path, calibration=None, overwrite=False, crop_to_fields=False,
+                  interpolation=cv2.INTER_LINEAR, workers=1, pyramid=False, compression='deflate'):
+    '''
+    Rotates the images of a sample folder. Rotated images already in the folder are
+    kept unless overwrite is True. Returns the rotation angle, or None if nothing
+    had to be rotated.
+
+    With crop_to_fields only the region around the fields is rotated, see
+    sample_fields_region. A region already saved in the calibration file is always
+    used, so all channels of a sample are cropped the same way. When a new region is
+    found every channel is rotated again, also the ones already saved. interpolation
+    and workers are passed on to rotate_channels, pyramid and compression to
+    write_image.
+    '''
+    missing = [(img_name, rotated_name) for img_name, rotated_name in channels
+               if overwrite or not os.path.exists(os.path.join(sample_path, rotated_name))]
+    if not missing:
+        return None
+
+    calibration_path = os.path.join(sample_path, calibration_file_name)
+    if calibration is None:
+        calibration = load_calibration(calibration_path) if os.path.exists(calibration_path) else {}
+
+    BF_image = cv2.imread(os.path.join(sample_path, BF_image_name))
+    if BF_image is None:
+        raise FileNotFoundError(f'Error loading {os.path.join(sample_path, BF_image_name)}')
+    rotation_degree, method = sample_rotation_degree(calibration, BF_image)
+
+    new_values = {'rotation_degree': rotation_degree, 'rotation_method': method}
+    region = calibration.get('rotation_region')
+    if region is None and crop_to_fields:
+        region = sample_fields_region(calibration, BF_image, rotation_degree)
+        new_values['rotation_region'] = region
+        if 'corners' in calibration:
+            # Saved field corners were clicked on the full rotated image and are moved to the cropped image
+            new_values['corners'] = [(x - region[0], y - region[1]) for x, y in calibration['corners']]
+        # Rotated images already saved are not cropped, so every channel is rotated again
+        missing = channels
+
+    images = []
+    for img_name, rotated_name in missing:
+        image = BF_image if img_name == BF_image_name else cv2.imread(os.path.join(sample_path, img_name))
+        if image is None:
+            raise FileNotFoundError(f'Error loading {os.path.join(sample_path, img_name)}')
+        images.append(image)
+
+    rotated_images = rotate_channels(rotation_degree, images, region, interpolation, workers)
+    for (img_name, rotated_name), rotated_image in zip(missing, rotated_images):
+        output_path = os.path.join(sample_path, rotated_name)
+        write_image(output_path, rotated_image, pyramid, compression)
+        print(f'Rotated image saved as {output_path}')
+
+    # The calibration is only changed once all rotated images are saved
+    save_calibration(calibration_path, **new_values)
+    return rotation_degree
+
+def run_batch_rotation(path, workers=1, overwrite=False, crop_to_fields=False, pyramid=False):
+    '''
+    Rotates every sample folder below path. Returns a list of (sample_folder, error)
+    for the samples that failed.
+
+    With workers above 1 that many samples are rotated at the same time, each in its
+    own process. Every process holds the full images of one sample, so lower workers
+    if the computer runs out of memory. crop_to_fields and pyramid are passed on to
+    rotate_sample.
+    '''
+    job = partial(rotate_sample, overwrite=overwrite, crop_to_fields=crop_to_fields, pyramid=pyramid)
+    _, failed = run_jobs(job, find_sample_folders(path), workers,
+                         describe=lambda rotation_degree: ('already rotated' if rotation_degree is None
+                                                           else f'rotated {rotation_degree:.3f} degrees'),
+                         what='samples', done='rotated')
+    return failed
+
+# Example usage
+if __name__ == "__main__":
+    # Every sample folder below this path is rotated
+    path = r'C:\Users\User\Desktop\Master\Titanium\proliferation\Imprints(PCmedTI)'
+
+    # Number of samples rotated at the same time, os.cpu_count() uses every core
+    workers = os.cpu_count()
+
+    run_batch_rotation(path, workers=workers)
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+'''
+Runs one job per sample or file and reports the progress, shared by the batch
+scripts (BatchAnalyseAfPitsCellebilleder.py, BatchRotationAfCellebilleder.py,
+Cellcount.py and ParticleAnalysis.py).
+
+A job that fails is reported and does not stop the other jobs. When all jobs are
+done it is printed how many succeeded, followed by the ones that failed.
+
+With more than one worker the jobs run in a process pool (or a thread pool for
+work that releases the GIL, like pyvips). A script using processes must run its
+code under  if __name__ == "__main__":, as every process imports the script. If
+the run is interrupted, the jobs that have not started yet are cancelled and the
+workers are shut down.
+'''
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+
+def run_jobs(function, items, workers=1, threads=False, name=str, describe=None, what='files', done='processed'):
+    '''
+    Calls function(item) for every item.
+
+    Parameters:
+    function (callable): The job. With processes it must be picklable, e.g. a
+        function defined at the top of a module or a functools.partial of one.
+    workers (int): With workers above 1 that many jobs run at the same time, with
+        1 they run one by one in this process in the order of items.
+    threads (bool): Use threads instead of processes.
+    name (callable): Gives the name of an item in the printed progress.
+    describe (callable, optional): Gives the text printed after the name of an item
+        from the result of its job.
+    what, done (str): Used in the last line, '<n> of <total> <what> were <done>'.
+
+    Returns:
+    tuple: (results, failed). results is a list of (item, result) for the jobs that
+    succeeded, in the order they finished, and failed a list of (name, error).
+    '''
+    items = list(items)
+    results = []
+    failed = []
+
+    def report(number, item, result=None, error=None):
+        if error is None:
+            results.append((item, result))
+            text = '' if describe is None else f': {describe(result)}'
+            print(f'[{number}/{len(items)}] {name(item)}{text}')
+        else:
+            failed.append((name(item), error))
+            print(f'[{number}/{len(items)}] Failed: {name(item)}: {error}')
+
+    if workers > 1 and len(items) > 1:
+        executor_class = ThreadPoolExecutor if threads else ProcessPoolExecutor
+        with executor_class(max_workers=workers) as executor:
+            futures = {executor.submit(function, item): item for item in items}
+            try:
+                for number, future in enumerate(as_completed(futures), start=1):
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        report(number, futures[future], error=e)
+                    else:
+                        report(number, futures[future], result)
+            except BaseException:
+                # Jobs that have not started are cancelled, so leaving the with block
+                # only waits for the running ones before the workers are shut down
+                for future in futures:
+                    future.cancel()
+                raise
+    else:
+        for number, item in enumerate(items, start=1):
+            try:
+                result = function(item)
+            except Exception as e:
+                report(number, item, error=e)
+            else:
+                report(number, item, result)
+
+    print()
+    print(f'{len(items) - len(failed)} of {len(items)} {what} were {done}')
+    for item_name, error in failed:
+        print(f'  {item_name}: {error}')
+    return results, failed
@@ -7,38 +7,171 @@ Created on Tue Jun 11 22:25:14 2024
 
 
 
-import numpy as np
-import cv2
 import os
+import tempfile
+
 import pyvips
-def extract_uv_image(vsi_path, output_dir):
-    # Load the VSI file using pyvips
-    image = pyvips.Image.new_from_file(vsi_path, access='sequential')
 
-    # Convert the pyvips image to a numpy array
-    image_data = np.ndarray(buffer=image.write_to_memory(),
-                            dtype=np.uint8,
-                            shape=[image.height, image.width, image.bands])
+from TiledImage import write_image
+from BatchRunner import run_jobs
+
+# Channels saved by export_channels. The key is the file name the other scripts expect
+# and the value the band of the .vsi file (or a list of bands for a colour image).
+# Check the order of the bands on the microscope and adjust this if needed
+vsi_channels = {'BF.tif': 0,
+                'Green Ex.tif': 1,
+                'UV.tif': -1,
+                'Multi Fluo.tif': [0, 1, 2]}
+
+def save_band(image, output_path, pyramid=False, compression='deflate', ome=False):
+    '''
+    Writes a pyvips image to disk while it is calculated, strip by strip, so the
+    full image is never held in memory. TIFF files are written tiled. With pyramid
+    a pyramid TIFF is written instead, see write_image in TiledImage.py.
+    '''
+    if pyramid:
+        write_image(output_path, image, pyramid=True, compression=compression, ome=ome)
+    elif output_path.lower().endswith(('.tif', '.tiff')):
+        image.tiffsave(output_path, tile=True)
+    else:
+        image.write_to_file(output_path)
+
+def normalise(image, minimum, maximum):
+    '''
+    Normalizes an image to the range 0-255 as an 8-bit image, the same as
+    cv2.normalize with cv2.NORM_MINMAX.
+    '''
+    scale = 255 / (maximum - minimum) if maximum > minimum else 0
+    return ((image - minimum) * scale).rint().cast('uchar')
+
+def extract_uv_image(vsi_path, output_dir, uv_channel_index=-1, output_name='uv_image.png', pyramid=False,
+                     compression='deflate', ome=False):
+    '''
+    Extracts the UV channel of a .vsi file, normalises it to 0-255 and saves it as
+    an 8-bit image in output_dir. pyramid, compression and ome are passed on to
+    save_band (output_name must then end with .tif).
+
+    The file is streamed through twice with pyvips, first for the minimum and
+    maximum of the UV band and then for the normalisation and the writing. Only the
+    UV band is used and only a few strips of the image are in memory at a time.
+    '''
+    # Load the VSI file using pyvips. Sequential images can only be read once,
+    # so the file is opened once for every pass
+    def uv_band():
+        image = pyvips.Image.new_from_file(vsi_path, access='sequential')
+        # Assume the UV channel is one of the channels in the image (e.g., the last channel)
+        # You might need to adjust this based on your specific data
+        return image.extract_band(uv_channel_index % image.bands)
 
-    # Assume the UV channel is one of the channels in the image (e.g., the last channel)
-    # You might need to adjust this based on your specific data
-    uv_channel_index = -1
-    uv_image = image_data[:, :, uv_channel_index]
+    # Minimum and maximum of the UV band in one pass (row 0 of stats() holds the
+    # statistics of all bands together, column 0 is the minimum and 1 the maximum)
+    stats = uv_band().stats()
+    minimum, maximum = stats(0, 0)[0], stats(1, 0)[0]
 
     # Normalize the UV image to the range 0-255 for saving as an 8-bit image
-    uv_image_normalized = cv2.normalize(uv_image, None, 0, 255, cv2.NORM_MINMAX).astype(np.uint8)
+    uv_image_normalized = normalise(uv_band(), minimum, maximum)
 
     # Create output directory if it doesn't exist
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
     # Save the UV image
-    output_path = os.path.join(output_dir, 'uv_image.png')
-    cv2.imwrite(output_path, uv_image_normalized)
+    output_path = os.path.join(output_dir, output_name)
+    save_band(uv_image_normalized, output_path, pyramid, compression, ome)
 
     print(f'UV image extracted and saved to {output_path}')
+    return output_path
+
+def export_channels(vsi_path, output_dir, channels=vsi_channels, pyramid=False, compression='deflate', ome=False):
+    '''
+    Saves all channels of a .vsi file (see vsi_channels) in output_dir, each
+    normalised to 0-255 like extract_uv_image. pyramid, compression and ome are
+    passed on to save_band.
+
+    The .vsi file is only decoded once. It is written to a temporary uncompressed
+    vips file in output_dir, which is memory mapped when the channels are read, so
+    the minimum and maximum of every band and all the channel images come from that
+    file instead of from decoding the .vsi file again for every channel.
+
+    Returns:
+    list: The paths of the saved images.
+    '''
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    # ignore_cleanup_errors, because on Windows pyvips can still hold the memory map
+    # of the temporary file when the folder is removed
+    with tempfile.TemporaryDirectory(dir=output_dir, ignore_cleanup_errors=True) as temp_dir:
+        decoded_path = os.path.join(temp_dir, 'decoded.v')
+        pyvips.Image.new_from_file(vsi_path, access='sequential').write_to_file(decoded_path)
+        image = pyvips.Image.new_from_file(decoded_path)
+
+        # Row 1 + band of stats() holds the statistics of that band, column 0 is the
+        # minimum and 1 the maximum. All bands are found in one pass
+        stats = image.stats()
+
+        output_paths = []
+        for name, bands in channels.items():
+            bands = [bands] if isinstance(bands, int) else bands
+            bands = [band % image.bands for band in bands]
+            minimum = min(stats(0, 1 + band)[0] for band in bands)
+            maximum = max(stats(1, 1 + band)[0] for band in bands)
+            channel = image.extract_band(bands[0])
+            if len(bands) > 1:
+                channel = channel.bandjoin([image.extract_band(band) for band in bands[1:]])
+            output_path = os.path.join(output_dir, name)
+            save_band(normalise(channel, minimum, maximum), output_path, pyramid, compression, ome)
+            output_paths.append(output_path)
+        # The images are released, so the temporary file can be removed
+        image = channel = None
+
+    print(f'{len(output_paths)} channels of {vsi_path} saved to {output_dir}')
+    return output_paths
+
+def _process_vsi_folder(function, vsi_dir, output_root, workers, kwargs):
+    '''
+    Calls function(vsi_path, output_dir, **kwargs) for every .vsi file in vsi_dir in
+    a thread pool. The output of 'name.vsi' goes to the folder 'name' in output_root
+    (vsi_dir if it is not given). Returns a list of (vsi_path, error) for the files
+    that failed.
+    '''
+    if output_root is None:
+        output_root = vsi_dir
+    vsi_paths = sorted(os.path.join(vsi_dir, name) for name in os.listdir(vsi_dir) if name.lower().endswith('.vsi'))
+
+    def process(vsi_path):
+        output_dir = os.path.join(output_root, os.path.splitext(os.path.basename(vsi_path))[0])
+        function(vsi_path, output_dir, **kwargs)
+
+    _, failed = run_jobs(process, vsi_paths, workers or os.cpu_count(), threads=True, done='extracted')
+    return failed
+
+def extract_uv_images(vsi_dir, output_root=None, workers=None, **kwargs):
+    '''
+    Extracts the UV image of every .vsi file in vsi_dir. The image of 'name.vsi' is
+    saved in the folder 'name' in output_root (vsi_dir if it is not given).
+    The files are converted in parallel, pyvips releases the GIL, so threads are
+    enough. Other keyword arguments are passed on to extract_uv_image.
+    Returns a list of (vsi_path, error) for the files that failed.
+    '''
+    return _process_vsi_folder(extract_uv_image, vsi_dir, output_root, workers, kwargs)
+
+def export_all_channels(vsi_dir, output_root=None, workers=None, **kwargs):
+    '''
+    Same as extract_uv_images, but saves all channels with export_channels, so every
+    folder gets BF.tif, UV.tif and the other images the scripts expect.
+    '''
+    return _process_vsi_folder(export_channels, vsi_dir, output_root, workers, kwargs)
 
 # Example usage
-vsi_path = r'C:\Users\User\Desktop\Master\29_5\Ti\Ti_1days.vsi'
-output_dir = r'C:\Users\User\Desktop\Master\29_5\Ti'
-extract_uv_image(vsi_path, output_dir)
\ No newline at end of file
+if __name__ == "__main__":
+    vsi_path = r'C:\Users\User\Desktop\Master\29_5\Ti\Ti_1days.vsi'
+    output_dir = r'C:\Users\User\Desktop\Master\29_5\Ti'
+    extract_uv_image(vsi_path, output_dir)
+
+    # Remove # to extract every .vsi file in a folder
+    # extract_uv_images(r'C:\Users\User\Desktop\Master\29_5\Ti')
+
+    # Remove # to save BF.tif, UV.tif, Green Ex.tif and Multi Fluo.tif of every .vsi file
+    # in a folder, decoding each file only once
+    # export_all_channels(r'C:\Users\User\Desktop\Master\29_5\Ti')
@@ -3,6 +3,8 @@ import numpy as np
 import matplotlib.pyplot as plt
 import pandas as pd
 
+from ParticleAnalysis import load_particle_dataset, summary_from_dataset
+
 # Function to read CSV file and calculate particle count statistics
 def calculate_particle_stats(folder_path, folder_name):
     # Find the CSV files in the folder
@@ -36,6 +38,17 @@ def gather_folder_results(base_directory):
     
     return folder_stats
 
+# Function to gather the same results from a particle dataset saved by ParticleAnalysis.py
+def gather_dataset_results(dataset_dir, experiments=None):
+    # All particles are read in one go instead of a CSV file per folder, and the
+    # particle count of every file is found with a group-by
+    summary = summary_from_dataset(load_particle_dataset(dataset_dir, experiments))
+    counts = summary.groupby('experiment')['Particle Count']
+
+    # Same (folder name, mean, std, sample size) as gather_folder_results, the experiment is the folder name
+    stats = pd.DataFrame({'mean': counts.mean(), 'std': counts.std().fillna(0), 'size': counts.size()})
+    return [(experiment, row['mean'], row['std'], int(row['size'])) for experiment, row in stats.iterrows()]
+
 # Function to plot the results with custom sorting and pillars (bars)
 def plot_results_enhanced(folder_stats, custom_order=None, title="Mean Particle Count per 1 cm^2", ymin=None, ymax=None):
     # Sort folder_stats based on custom_order if provided
@@ -93,6 +106,10 @@ base_directory = r"C:\Users\User\Desktop\Master\Titanium\proliferation\Flade\For
 
 folder_stats = gather_folder_results(base_directory)
 
+# Remove # to use the particle dataset saved by ParticleAnalysis.py instead of the CSV files
+#dataset_dir = r"C:\Users\User\Desktop\Master\Particle dataset"
+#folder_stats = gather_dataset_results(dataset_dir)
+
 # Define custom order for the folder names
 custom_order = ['1 day 0min', '1 day 5min', '1 day 10min','4 day 0min', '4 day 5min', '4 day 10min', '6 day 0min', '6 day 5min', '6 day 10min']  # You can modify this to your desired order
 custom_order = ['0 min', '5 min', '10 min']
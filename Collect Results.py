@@ -33,137 +33,198 @@ def gather_xlsx_files(source_root, target_folder):
                 print(f"No xlsx file found in {folder_path}, skipping...")
 
 # Example usage
-source_root = 'C:/Users/User/Desktop/Andreas script - Data folder/Andreas script - Data folder/Your cell data/Imprints(PCmedTI)'  # Replace with the path to the source root
-target_folder = 'C:/Users/User/Desktop/Andreas script - Data folder/Andreas script - Data folder/Your cell data/Imprints(PCmedTI) resultater'  # Replace with the path to the target folder
-gather_xlsx_files(source_root, target_folder)
+if __name__ == "__main__":
+    source_root = 'C:/Users/User/Desktop/Andreas script - Data folder/Andreas script - Data folder/Your cell data/Imprints(PCmedTI)'  # Replace with the path to the source root
+    target_folder = 'C:/Users/User/Desktop/Andreas script - Data folder/Andreas script - Data folder/Your cell data/Imprints(PCmedTI) resultater'  # Replace with the path to the target folder
+    gather_xlsx_files(source_root, target_folder)
 
 
 
- #%%
 #%% Collecter dem i samlet excel fil
-import os
-import pandas as pd
+import re
+from concurrent.futures import ProcessPoolExecutor
 
-def extract_count_columns_from_files(source_folder, target_folder, days, samples):
-    # Create the target folder if it doesn't exist
-    os.makedirs(target_folder, exist_ok=True)
-
-    # Dictionary to hold the extracted data grouped by day
-    grouped_data = {}
+import pandas as pd
 
-    # Iterate through each file in the source folder
-    for file_name in os.listdir(source_folder):
-        if file_name.endswith('.xlsx'):
+from ExcelLoader import read_excel
+
+# Patterns finding the metadata in the name of a result file (or in cell A1 of it, see
+# collect_counts). Every named group becomes a column, e.g. 'day' and 'sample'
+imprint_pattern = r'[Dd]ag_(?P<day>\d+)_sample_(?P<sample>\d+)'
+PC_pattern = r'(?P<day>\d+)day_.*?(?P<nm>\d+)nm.*?sample(?P<sample>\d+)'
+
+def read_results_manifest(manifest_path):
+    '''
+    Reads a manifest (a CSV file) with a line per result file. The column 'file' is
+    the name of the file in the source folder and every other column (day, nm,
+    material, sample ...) is metadata of the file:
+
+        file,day,material,sample
+        _Dag_5_sample_2_.xlsx,5,Ti,2
+
+    Returns a dictionary with the file name as key and the metadata as value.
+    '''
+    manifest = pd.read_csv(manifest_path, dtype=str, comment='#', skipinitialspace=True).fillna('')
+    if 'file' not in manifest.columns:
+        raise ValueError(f"The manifest {manifest_path} needs a 'file' column")
+    duplicates = manifest['file'][manifest['file'].duplicated()]
+    if len(duplicates):
+        raise ValueError(f'Files in the manifest more than once: {list(duplicates)}')
+    return {row.pop('file'): row for row in manifest.to_dict('records')}
+
+def read_count_file(file_path):
+    '''
+    Reads a CellCountData file. Returns the name in cell A1 (the sample name written
+    by AnalyseAfPitsCellebilleder.py) and a DataFrame with the columns 'field' (the
+    field number, field i is in row i + 1), 'Sample' (the first column, the label of
+    the template, which can be the same for several fields) and 'Count' (the second
+    column) of the rows below it.
+    '''
+    df = read_excel(file_path, header=None)
+    name = df.iat[0, 0] if df.shape[0] else None
+    counts = df.iloc[1:, :2].set_axis(['Sample', 'Count'], axis=1).reset_index(drop=True)
+    counts.insert(0, 'field', range(1, len(counts) + 1))
+    # The empty B1 made the counts decimal numbers, whole counts are made integers again
+    count = pd.to_numeric(counts['Count'])
+    if count.notna().all() and (count % 1 == 0).all():
+        count = count.astype('int64')
+    counts['Count'] = count
+    return ('' if pd.isna(name) else str(name)), counts
+
+def _numbers(value):
+    '''
+    Metadata that is a whole number is used as a number, so it matches days=[1, 3, 5].
+    '''
+    return int(value) if isinstance(value, str) and value.strip().isdigit() else value
+
+def collect_counts(source_folder, manifest_path=None, pattern=None, use_name=False, workers=None, strict=True):
+    '''
+    Reads every .xlsx file in source_folder into one long table with a row per field
+    and file and the metadata of the file as columns.
+
+    The metadata of a file is taken from the manifest (see read_results_manifest) if
+    the file is in it, otherwise from the regular expression pattern, which is matched
+    against the file name, or against the sample name in cell A1 if use_name is True.
+
+    Files without metadata, files in the manifest that do not exist and files that
+    can not be read are never skipped silently: they are all listed, and with strict
+    a ValueError is raised instead of returning an incomplete table.
+
+    The files are read in parallel in workers processes (all cores if it is None).
+
+    Returns:
+    DataFrame: The columns 'file', the metadata columns, 'field', 'Sample' and 'Count'.
+    '''
+    manifest = read_results_manifest(manifest_path) if manifest_path else {}
+    file_names = sorted(f for f in os.listdir(source_folder) if f.endswith('.xlsx') and not f.startswith('~$'))
+    problems = [f'{file_name}: in the manifest but not in {source_folder}'
+                for file_name in manifest if file_name not in file_names]
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # A future per file, so a file that can not be read does not stop the others
+        futures = [executor.submit(read_count_file, os.path.join(source_folder, f)) for f in file_names]
+        tables = []
+        for file_name, future in zip(file_names, futures):
             try:
-                parts = file_name.split('_')
-                # Extract day (from "dag X") and sample number (from "sample X")
-                day = int(parts[2])  # Extract day number from parts[2]
-                sample = int(parts[4])  # Extract sample number from parts[4]
-            except (IndexError, ValueError):
-                print(f"Filename {file_name} does not match the expected pattern, skipping...")
+                name, counts = future.result()
+            except Exception as e:
+                problems.append(f'{file_name}: could not be read ({e})')
                 continue
 
-            if day in days and sample in samples:
-                file_path = os.path.join(source_folder, file_name)
-                print(f"Processing file: {file_path}")
-
-                # Read the Excel file, skipping the first row
-                df = pd.read_excel(file_path, skiprows=[0], header=None)
-
-                # Assuming the first column is 'Sample' and the second column is 'Count'
-                sample_column = df.iloc[:, 0]
-                count_column = df.iloc[:, 1]
-                column_name = f"Sample{sample}"
-                
-                # Create a key for grouping
-                key = day
-                
-                if key not in grouped_data:
-                    grouped_data[key] = pd.DataFrame()
-                    grouped_data[key]['Sample'] = sample_column
-                
-                grouped_data[key][column_name] = count_column
+            if file_name in manifest:
+                metadata = dict(manifest[file_name])
             else:
-                print(f"Filename {file_name} does not match the expected day or sample values, skipping...")
-
-    # Save combined data for each group (by day)
-    for day, combined_df in grouped_data.items():
-        target_file = os.path.join(target_folder, f"Dag_{day}_combined.xlsx")
+                match = re.search(pattern, name if use_name else file_name) if pattern else None
+                if match is None:
+                    problems.append(f'{file_name}: not in the manifest and does not match the pattern')
+                    continue
+                metadata = match.groupdict()
+            metadata = {key: _numbers(value) for key, value in metadata.items()}
+            tables.append(counts.assign(file=file_name, **metadata))
+
+    for problem in problems:
+        print(problem)
+    if problems and strict:
+        raise ValueError(f'{len(problems)} of the result files could not be collected, see the list above')
+
+    if not tables:
+        return pd.DataFrame(columns=['file', 'field', 'Sample', 'Count'])
+    long_table = pd.concat(tables, ignore_index=True)
+    first_columns = ['file'] + [c for c in long_table.columns if c not in ('file', 'field', 'Sample', 'Count')]
+    return long_table[first_columns + ['field', 'Sample', 'Count']]
+
+def select(long_table, **values):
+    '''
+    Keeps the rows where every given column has one of the given values, e.g.
+    select(long_table, day=[1, 3, 5], sample=[1, 2, 3]). The number of files left out
+    is printed.
+    '''
+    keep = pd.Series(True, index=long_table.index)
+    for column, allowed in values.items():
+        keep &= long_table[column].isin(list(allowed))
+    left_out = long_table.loc[~keep, 'file'].nunique()
+    if left_out:
+        print(f'{left_out} files do not have the chosen {", ".join(values)} and are left out')
+    return long_table[keep]
+
+def combine_counts(long_table, group_keys=('day',), column_key='sample', column_prefix='Sample'):
+    '''
+    Makes the combined tables: one per value of group_keys (e.g. per day, or per
+    (day, nm)), with the 'Sample' column of the files and a column of counts for
+    every value of column_key, named column_prefix + value (Sample1, Sample2 ...).
+
+    The rows are lined up by the field (the row in the file), as the labels in the
+    'Sample' column repeat (e.g. several 'C' fields). The labels are taken from the
+    first file of the group.
+
+    Returns a dictionary with the group (a tuple of the group_keys values) as key
+    and the combined table as value.
+    '''
+    group_keys = list(group_keys)
+    duplicated = long_table.duplicated(group_keys + [column_key, 'field'], keep=False)
+    if duplicated.any():
+        files = sorted(long_table.loc[duplicated, 'file'].unique())
+        raise ValueError(f'More than one file has the same {", ".join(group_keys + [column_key])}: {files}')
+
+    combined = {}
+    for key, group in long_table.groupby(group_keys, sort=True):
+        table = group.pivot(index='field', columns=column_key, values='Count')
+        table.columns = [f'{column_prefix}{value}' for value in table.columns]
+        labels = group.drop_duplicates('field').set_index('field')['Sample']
+        table.insert(0, 'Sample', labels.reindex(table.index))
+        combined[key] = table.reset_index(drop=True)
+    return combined
+
+def save_combined(combined, target_folder, file_name_format, group_keys=('day',)):
+    '''
+    Saves every table from combine_counts as an Excel file. file_name_format is
+    filled in with the group_keys, e.g. 'Dag_{day}_combined.xlsx'.
+    '''
+    os.makedirs(target_folder, exist_ok=True)
+    for key, combined_df in combined.items():
+        target_file = os.path.join(target_folder, file_name_format.format(**dict(zip(group_keys, key))))
         combined_df.to_excel(target_file, index=False)
-        print(f"Combined data for {day} saved to {target_file}")
+        print(f"Combined data for {key} saved to {target_file}")
 
 # Example usage
-source_folder = 'C:/Users/User/Desktop/Andreas script - Data folder/Andreas script - Data folder/Your cell data/Imprints(PCmedTI) resultater'  # Replace with the path to the source folder
-target_folder = 'C:/Users/User/Desktop/Andreas script - Data folder/Andreas script - Data folder/Your cell data/Imprints(PCmedTI) resultater'  # Replace with the path to the target folder
-
-# Lists of valid values
-days = [1, 3, 5]
-samples = [1, 2, 3]
-
-# Now correctly passing both days and samples to the function
-extract_count_columns_from_files(source_folder, target_folder, days, samples)
-
-
-
+if __name__ == "__main__":
+    source_folder = 'C:/Users/User/Desktop/Andreas script - Data folder/Andreas script - Data folder/Your cell data/Imprints(PCmedTI) resultater'  # Replace with the path to the source folder
+    target_folder = 'C:/Users/User/Desktop/Andreas script - Data folder/Andreas script - Data folder/Your cell data/Imprints(PCmedTI) resultater'  # Replace with the path to the target folder
 
-#%% Collecter dem i samlet excel fil for PC samples
-import os
-import pandas as pd
+    # Optional CSV file with the metadata of every file, see read_results_manifest. Files that are
+    # not in it get their metadata from the file name with the pattern
+    manifest_path = None
 
-def extract_count_columns_from_files(source_folder, target_folder, days, nms, samples):
-    # Create the target folder if it doesn't exist
-    os.makedirs(target_folder, exist_ok=True)
+    long_table = collect_counts(source_folder, manifest_path, pattern=imprint_pattern)
 
-    # Dictionary to hold the extracted data grouped by (#day, #nm)
-    grouped_data = {}
-
-    # Iterate through each file in the source folder
-    for file_name in os.listdir(source_folder):
-        if file_name.endswith('.xlsx'):
-            try:
-                parts = file_name.split('_')
-                day = int(parts[2].replace('day', ''))
-                sample = int(parts[5].replace('sample', '').replace('.xlsx', ''))
-            except (IndexError, ValueError):
-                print(f"Filename {file_name} does not match the expected pattern, skipping...")
-                continue
-
-            if day in days and nm in nms and sample in samples:
-                file_path = os.path.join(source_folder, file_name)
-                print(f"Processing file: {file_path}")
-
-                # Read the Excel file, skipping the first row
-                df = pd.read_excel(file_path, skiprows=[0], header=None)
-
-                # Assuming the first column is 'Sample' and the second column is 'Count'
-                sample_column = df.iloc[:, 0]
-                count_column = df.iloc[:, 1]
-                column_name = f"Sample{sample}"
-                
-                # Create a key for grouping
-                key = (day, nm)
-                
-                if key not in grouped_data:
-                    grouped_data[key] = pd.DataFrame()
-                    grouped_data[key]['Sample'] = sample_column
-                
-                grouped_data[key][column_name] = count_column
-            else:
-                print(f"Filename {file_name} does not match the expected day, nm, or sample values, skipping...")
-
-    # Save combined data for each group (#day, #nm)
-    for (day, nm), combined_df in grouped_data.items():
-        target_file = os.path.join(target_folder, f"PC_{day}day_nominUV_{nm}nm.xlsx")
-        combined_df.to_excel(target_file, index=False)
-        print(f"Combined data for {day}day  saved to {target_file}")
-
-# Example usage
-source_folder = 'C:/Users/User/Desktop/Andreas script - Data folder/Andreas script - Data folder/Your cell data/Imprints(PCmedTI) resultater'  # Replace with the path to the source folder
-target_folder = 'C:/Users/User/Desktop/Andreas script - Data folder/Andreas script - Data folder/Your cell data/Imprints(PCmedTI) resultater'  # Replace with the path to the target folder
+    # Lists of valid values
+    long_table = select(long_table, day=[1, 3, 5], sample=[1, 2, 3])
 
-# Lists of valid values
-days = [1, 3, 5]
-nms = [500, 2500]
-samples = [1, 2, 3]
+    combined = combine_counts(long_table, group_keys=['day'])
+    save_combined(combined, target_folder, 'Dag_{day}_combined.xlsx', group_keys=['day'])
 
-extract_count_columns_from_files(source_folder, target_folder, days, samples)
+    # The PC samples are grouped by day and nm
+    # long_table = select(collect_counts(source_folder, manifest_path, pattern=PC_pattern),
+    #                     day=[1, 3, 5], nm=[500, 2500], sample=[1, 2, 3])
+    # combined = combine_counts(long_table, group_keys=['day', 'nm'])
+    # save_combined(combined, target_folder, 'PC_{day}day_nominUV_{nm}nm.xlsx', group_keys=['day', 'nm'])
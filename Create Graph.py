@@ -1,21 +1,22 @@
 import os
-import pandas as pd
 import matplotlib.pyplot as plt
 
-def calculate_global_y_limits(source_folder, days, selected_samples=None):
+from ExcelLoader import read_excel_files
+
+def load_dataset(source_folder, days, selected_samples=None, workers=None):
     """
-    Calculate global y-axis limits across all relevant Excel files for consistent plotting.
+    Read every relevant Excel file once into memory.
 
     Parameters:
         source_folder (str): Path to the folder containing Excel files.
         days (list of int): List of day values to filter the files.
         selected_samples (list of str, optional): List of sample names to include. Defaults to None, meaning all samples are included.
+        workers (int, optional): Number of processes reading the files, see read_excel_files in ExcelLoader.py.
 
     Returns:
-        dict: Dictionary with day as keys and (min, max) tuples as values for y-axis limits.
+        list of dict: One entry per file with 'file_name', 'day', 'nm' (None if the filename has no nm value) and the filtered 'df'.
     """
-    y_limits = {day: (float('inf'), float('-inf')) for day in days}
-
+    entries = []
     for file_name in os.listdir(source_folder):
         if file_name.endswith('.xlsx'):
             try:
@@ -25,18 +26,50 @@ def calculate_global_y_limits(source_folder, days, selected_samples=None):
                 continue
 
             if day in days:
-                file_path = os.path.join(source_folder, file_name)
-                df = pd.read_excel(file_path)
-
-                # Filter rows based on selected samples, if provided
-                if selected_samples:
-                    df = filter_samples(df, selected_samples)
+                try:
+                    nm = extract_day_and_nm_from_filename(file_name)[1]
+                except ValueError:
+                    nm = None
+                entries.append({'file_name': file_name, 'day': day, 'nm': nm})
+
+    # All files are parsed in one go, each exactly once
+    frames = read_excel_files([os.path.join(source_folder, entry['file_name']) for entry in entries], workers)
+    for entry, df in zip(entries, frames):
+        # Filter rows based on selected samples, if provided
+        entry['df'] = filter_samples(df, selected_samples) if selected_samples else df
+    return entries
+
+def y_limits_from_dataset(dataset, days):
+    """
+    Calculate global y-axis limits per day from the loaded files for consistent plotting.
 
-                if not df.empty:
-                    update_y_limits(y_limits, day, df)
+    Parameters:
+        dataset (list of dict): The files from load_dataset.
+        days (list of int): List of day values.
 
+    Returns:
+        dict: Dictionary with day as keys and (min, max) tuples as values for y-axis limits.
+    """
+    y_limits = {day: (float('inf'), float('-inf')) for day in days}
+    for entry in dataset:
+        if not entry['df'].empty:
+            update_y_limits(y_limits, entry['day'], entry['df'])
     return y_limits
 
+def calculate_global_y_limits(source_folder, days, selected_samples=None):
+    """
+    Calculate global y-axis limits across all relevant Excel files for consistent plotting.
+
+    Parameters:
+        source_folder (str): Path to the folder containing Excel files.
+        days (list of int): List of day values to filter the files.
+        selected_samples (list of str, optional): List of sample names to include. Defaults to None, meaning all samples are included.
+
+    Returns:
+        dict: Dictionary with day as keys and (min, max) tuples as values for y-axis limits.
+    """
+    return y_limits_from_dataset(load_dataset(source_folder, days, selected_samples), days)
+
 def extract_day_from_filename(file_name):
     """
     Extract the day number from the filename.
@@ -91,36 +124,32 @@ def update_y_limits(y_limits, day, df):
     current_min, current_max = y_limits[day]
     y_limits[day] = (min(current_min, min_count), max(current_max, max_count))
 
-def plot_excel_files(source_folder, days, nms, selected_samples=None):
+def plot_excel_files(source_folder, days, nms, selected_samples=None, workers=None):
     """
     Process Excel files and generate plots for specified days, nm values, and samples.
 
+    Every file is read once. The y-axis limits of a day are calculated from all its
+    files before anything is plotted.
+
     Parameters:
         source_folder (str): Path to the folder containing Excel files.
         days (list of int): List of day values to filter files.
         nms (list of int): List of nm values to filter files.
         selected_samples (list of str, optional): List of sample names to include. Defaults to None.
+        workers (int, optional): Number of processes reading the files, see read_excel_files in ExcelLoader.py.
     """
-    y_limits = calculate_global_y_limits(source_folder, days, selected_samples)
-
-    for file_name in os.listdir(source_folder):
-        if file_name.endswith('.xlsx'):
-            try:
-                day, nm = extract_day_and_nm_from_filename(file_name)
-            except ValueError:
-                print(f"Skipping file due to naming issues: {file_name}")
-                continue
-
-            if day in days and nm in nms:
-                file_path = os.path.join(source_folder, file_name)
-                print(f"Processing file: {file_path}")
-                df = pd.read_excel(file_path)
-
-                if selected_samples:
-                    df = filter_samples(df, selected_samples)
-
-                if not df.empty:
-                    plot_data(df, day, nm, y_limits[day])
+    dataset = load_dataset(source_folder, days, selected_samples, workers)
+    y_limits = y_limits_from_dataset(dataset, days)
+
+    for entry in dataset:
+        if entry['nm'] is None:
+            print(f"Skipping file due to naming issues: {entry['file_name']}")
+            continue
+
+        if entry['nm'] in nms:
+            print(f"Processing file: {os.path.join(source_folder, entry['file_name'])}")
+            if not entry['df'].empty:
+                plot_data(entry['df'], entry['day'], entry['nm'], y_limits[entry['day']])
 
 def extract_day_and_nm_from_filename(file_name):
     """
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+'''
+Shared Excel loader for the plotting scripts.
+
+pd.read_excel is the slowest part of making the figures, and the workbooks rarely
+change between two runs. read_excel therefore saves every sheet it reads as a
+Parquet file in the folder 'Zbehandlet - Excel cache' next to the workbook. The
+cache file is named after the workbook, its modification time and size and the
+arguments given to read_excel, so a changed workbook is read again and the cache
+never has to be cleared by hand. When a changed workbook is cached, the cache files
+of its earlier versions are removed.
+
+Workbooks that are not cached are read with the calamine engine if it is installed
+(pip install python-calamine), which is many times faster than openpyxl, and
+read_excel_files reads many workbooks in a process pool.
+'''
+
+import hashlib
+import importlib.util
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+# Folder made next to the workbooks for the cached sheets
+cache_folder_name = 'Zbehandlet - Excel cache'
+
+# Part of the cache file names, changed when the format of the cache files changes so
+# old cache files are not used
+cache_version = 2
+
+# calamine is used when it is installed, otherwise pandas chooses the engine (openpyxl)
+excel_engine = 'calamine' if importlib.util.find_spec('python_calamine') else None
+
+
+def cache_path(file_path, **kwargs):
+    '''
+    The Parquet file a sheet read with read_excel(file_path, **kwargs) is cached in.
+    The name is the name of the workbook followed by a key for the version of the
+    workbook and a key for the arguments.
+    '''
+    kwargs_key = hashlib.sha1(repr(sorted(kwargs.items())).encode()).hexdigest()[:8]
+    name = f'{os.path.basename(file_path)} {_workbook_key(file_path)}-{kwargs_key}.parquet'
+    return os.path.join(os.path.dirname(file_path), cache_folder_name, name)
+
+def _workbook_key(file_path):
+    '''
+    Key for the version of a workbook, it changes when the workbook is saved.
+    '''
+    status = os.stat(file_path)
+    key = repr((cache_version, os.path.abspath(file_path), status.st_mtime_ns, status.st_size))
+    return hashlib.sha1(key.encode()).hexdigest()[:8]
+
+def _remove_old_caches(path):
+    '''
+    Removes the cache files of earlier versions of the workbook cached in path. Cache
+    files of the same version read with other arguments are kept.
+    '''
+    folder, name = os.path.split(path)
+    workbook_name, key = name.rsplit(' ', 1)
+    workbook_key = key.split('-')[0]
+    for other in os.listdir(folder):
+        if not other.startswith(workbook_name + ' '):
+            continue
+        other_key = other[len(workbook_name) + 1:]
+        # A space is left when the name belongs to another workbook with a longer name
+        if ' ' not in other_key and other_key.split('-')[0] != workbook_key:
+            try:
+                os.remove(os.path.join(folder, other))
+            except OSError:
+                pass
+
+def _read_workbook(file_path, kwargs):
+    '''
+    Reads a sheet with pandas, using calamine if it is installed.
+    '''
+    if excel_engine is not None and 'engine' not in kwargs:
+        kwargs = dict(kwargs, engine=excel_engine)
+    return pd.read_excel(file_path, **kwargs)
+
+def _encoded_columns(columns):
+    '''
+    The column labels as JSON text, so labels that are not text (e.g. the numbers of
+    a header row, or the numbered columns of header=None) get their type back when
+    the cache is loaded. None if the labels can not be saved like that.
+    '''
+    if isinstance(columns, pd.MultiIndex):
+        return None
+    try:
+        # numpy numbers are saved as the Python number they hold
+        names = [json.dumps(column, default=lambda value: value.item()) for column in columns]
+    except (TypeError, ValueError, AttributeError):
+        return None
+    if [json.loads(name) for name in names] != list(columns):
+        return None
+    return names
+
+def _save_cache(df, path):
+    '''
+    Saves a sheet in the cache. Parquet needs text column names, so the column labels
+    are saved as JSON text (see _encoded_columns). Sheets Parquet can not hold (e.g.
+    a column mixing text and numbers, like the CellCountData files read with
+    header=None, or column labels that are not numbers or text), or all sheets if
+    neither pyarrow nor fastparquet is installed, are saved as a pickle file instead.
+    '''
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Written to a temporary file first, so an interrupted run does not leave half a cache
+    temporary_path = path + '.tmp'
+    columns = _encoded_columns(df.columns)
+    try:
+        if columns is None:
+            raise TypeError('The column labels can not be saved in Parquet')
+        df.set_axis(columns, axis=1).to_parquet(temporary_path)
+    except (ImportError, ValueError, TypeError):
+        df.to_pickle(temporary_path, compression=None)
+        path = os.path.splitext(path)[0] + '.pkl'
+    os.replace(temporary_path, path)
+    _remove_old_caches(path)
+
+def _load_cache(path):
+    '''
+    Loads a cached sheet, or returns None if it is not cached.
+    '''
+    pickle_path = os.path.splitext(path)[0] + '.pkl'
+    if os.path.exists(pickle_path):
+        return pd.read_pickle(pickle_path, compression=None)
+    if not os.path.exists(path):
+        return None
+    df = pd.read_parquet(path)
+    return df.set_axis([json.loads(column) for column in df.columns], axis=1)
+
+def read_excel(file_path, **kwargs):
+    '''
+    Same as pd.read_excel(file_path, **kwargs) for a single sheet, but the sheet is
+    only parsed the first time (or when the workbook has changed), after that it is
+    loaded from the cache.
+    '''
+    if kwargs.get('sheet_name', 0) is None or isinstance(kwargs.get('sheet_name'), list):
+        # More sheets at once give a dictionary, which is read without the cache
+        return _read_workbook(file_path, kwargs)
+
+    path = cache_path(file_path, **kwargs)
+    df = _load_cache(path)
+    if df is None:
+        df = _read_workbook(file_path, kwargs)
+        _save_cache(df, path)
+    return df
+
+def _read_and_cache(file_path, kwargs):
+    '''
+    read_excel for the process pool.
+    '''
+    return read_excel(file_path, **kwargs)
+
+def read_excel_files(file_paths, workers=None, **kwargs):
+    '''
+    read_excel for many workbooks. Returns the DataFrames in the order of file_paths.
+
+    Cached sheets are loaded right away and the others are read in workers
+    processes (all cores if it is None, 1 reads them one by one). A script using
+    more than one worker must run its code under if __name__ == "__main__":, as
+    every process imports the script.
+    '''
+    file_paths = list(file_paths)
+    frames = [_load_cache(cache_path(file_path, **kwargs)) for file_path in file_paths]
+    missing = [i for i, df in enumerate(frames) if df is None]
+
+    if workers == 1 or len(missing) <= 1:
+        for i in missing:
+            frames[i] = read_excel(file_paths[i], **kwargs)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for i, df in zip(missing, executor.map(_read_and_cache, [file_paths[i] for i in missing],
+                                                   [kwargs] * len(missing))):
+                frames[i] = df
+    return frames
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+'''
+Image viewer with X, Y and Zoom trackbars, shared by AnalyseAfPitsCellebilleder.py
+and RotationAfCellebilleder.py.
+
+Clicking on the image saves the coordinates of the click relative to the full image.
+To keep dragging smooth on large scans the viewer keeps an image pyramid (the image
+at full, half, quarter ... resolution) cut into tiles. A redraw only touches the
+tiles that are on screen, taken from the level matching the zoom, and tiles are
+kept in a cache between redraws.
+
+An overlay (like the numbered field overlay used for the calibration) can be given
+together with the image. It is stretched over the image like cv2.resize would do,
+but only the part under a tile is resized and blended into the tile when the tile is
+made, so neither a full size overlay nor a blended copy of the full image is made.
+'''
+
+import math
+from collections import OrderedDict
+
+import numpy as np
+import cv2
+
+
+class ImageViewer:
+    '''
+    Shows an image in a window with trackbars for X, Y and Zoom.
+
+    Parameters:
+    image (numpy.ndarray): The image to show.
+    window_name (str): Name of the window.
+    window_size (int): Side length of the (square) window in pixels.
+    clicks (list, optional): List the clicked (x, y) coordinates are appended to.
+        A new list is made if it is not given.
+    max_clicks (int, optional): Clicks are only saved while the list is shorter
+        than this. No limit if it is not given.
+    min_zoom_level (int): Minimum zoom level in percent to prevent distortion.
+    overlay (numpy.ndarray, optional): Image with the same number of channels as image,
+        of any size. It is stretched over the image and blended on top of it.
+    alpha (float): Transparency factor for the overlay.
+    '''
+
+    tile_size = 256
+    max_cached_tiles = 512
+
+    def __init__(self, image, window_name, window_size=800, clicks=None, max_clicks=None, min_zoom_level=10,
+                 overlay=None, alpha=0.5):
+        self.window_name = window_name
+        self.window_size = window_size
+        self.clicks = [] if clicks is None else clicks
+        self.max_clicks = max_clicks
+        self.min_zoom_level = min_zoom_level
+        self.height, self.width = image.shape[:2]
+
+        # x and y values one is currently looking at and the zoom level in percent
+        self.current_x, self.current_y = 0, 0
+        self.zoom_level = 100
+
+        if overlay is not None and overlay.shape[2:] != image.shape[2:]:
+            raise ValueError(f'The overlay has the shape {overlay.shape} and the image {image.shape}')
+        self.alpha = alpha
+        self._levels = [image]
+        self._overlay_levels = None if overlay is None else [overlay]
+        self._tiles = OrderedDict()
+
+    @staticmethod
+    def _pyramid_level(levels, level):
+        '''
+        Returns the image at the given pyramid level, the size is halved for every level.
+        The levels are made the first time they are needed.
+        '''
+        while len(levels) <= level:
+            levels.append(cv2.pyrDown(levels[-1]))
+        return levels[level]
+
+    def _level(self, level):
+        return self._pyramid_level(self._levels, level)
+
+    def _make_tile(self, level, tile_x, tile_y):
+        '''
+        Cuts a tile out of a pyramid level and blends the overlay into it.
+        '''
+        size = self.tile_size
+        image_level = self._level(level)
+        tile = image_level[tile_y*size:(tile_y+1)*size, tile_x*size:(tile_x+1)*size]
+        if self._overlay_levels is None:
+            return tile
+
+        # The part of the overlay under the tile, resized to the tile. The overlay is only
+        # taken from a smaller pyramid level while that is still larger than the image level,
+        # and the pixel centres are mapped like cv2.resize does
+        overlay_level = self._overlay_levels[0]
+        for smaller in range(1, level + 1):
+            if self._pyramid_level(self._overlay_levels, smaller).shape[1] < image_level.shape[1]:
+                break
+            overlay_level = self._overlay_levels[smaller]
+        scale_x = overlay_level.shape[1] / image_level.shape[1]
+        scale_y = overlay_level.shape[0] / image_level.shape[0]
+        matrix = np.array([[scale_x, 0, (tile_x*size + 0.5) * scale_x - 0.5],
+                           [0, scale_y, (tile_y*size + 0.5) * scale_y - 0.5]])
+        overlay_tile = cv2.warpAffine(overlay_level, matrix, (tile.shape[1], tile.shape[0]),
+                                      flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP, borderMode=cv2.BORDER_REPLICATE)
+        return cv2.addWeighted(tile, 1 - self.alpha, overlay_tile, self.alpha, 0)
+
+    def _tile(self, level, tile_x, tile_y):
+        '''
+        Returns a tile from the cache, the least recently used tiles are thrown away.
+        '''
+        key = (level, tile_x, tile_y)
+        if key in self._tiles:
+            self._tiles.move_to_end(key)
+            return self._tiles[key]
+        tile = self._make_tile(level, tile_x, tile_y)
+        self._tiles[key] = tile
+        if len(self._tiles) > self.max_cached_tiles:
+            self._tiles.popitem(last=False)
+        return tile
+
+    def _region(self, level, x0, y0, x1, y1):
+        '''
+        Puts the region [x0:x1, y0:y1] of a pyramid level together from tiles.
+        '''
+        size = self.tile_size
+        first_tile = self._tile(level, x0 // size, y0 // size)
+        region = np.zeros((y1 - y0, x1 - x0) + first_tile.shape[2:], dtype=first_tile.dtype)
+        for tile_y in range(y0 // size, (y1 - 1) // size + 1):
+            for tile_x in range(x0 // size, (x1 - 1) // size + 1):
+                tile = self._tile(level, tile_x, tile_y)
+                # Part of the tile inside the region, in level coordinates
+                ax0, ay0 = max(x0, tile_x*size), max(y0, tile_y*size)
+                ax1, ay1 = min(x1, tile_x*size + tile.shape[1]), min(y1, tile_y*size + tile.shape[0])
+                region[ay0-y0:ay1-y0, ax0-x0:ax1-x0] = tile[ay0-tile_y*size:ay1-tile_y*size, ax0-tile_x*size:ax1-tile_x*size]
+        return region
+
+    def render(self):
+        '''
+        Returns what the window shows at the current position and zoom level.
+        Outside the image the window is black.
+        '''
+        zoom_factor = self.zoom_level / 100.0
+        display = np.zeros((self.window_size, self.window_size) + self._levels[0].shape[2:], dtype=self._levels[0].dtype)
+
+        # Size of the displayed area in full image pixels
+        x, y = self.current_x, self.current_y
+        x_end = min(x + int(self.window_size / zoom_factor), self.width)
+        y_end = min(y + int(self.window_size / zoom_factor), self.height)
+        if x_end <= x or y_end <= y:
+            return display
+
+        # The pyramid level with just enough pixels for the window
+        level = max(0, int(math.floor(math.log2(1 / zoom_factor)))) if zoom_factor < 1 else 0
+        while level > 0 and (self.width >> level) < 1:
+            level -= 1
+        scale = 2 ** level
+
+        x0, y0 = x // scale, y // scale
+        x1 = min(max(-(-x_end // scale), x0 + 1), self._level(level).shape[1])
+        y1 = min(max(-(-y_end // scale), y0 + 1), self._level(level).shape[0])
+        region = self._region(level, x0, y0, x1, y1)
+
+        # Resize the region to the window, pixels are zoom_factor * scale display pixels wide
+        display_w = min(round((x1 - x0) * scale * zoom_factor), self.window_size)
+        display_h = min(round((y1 - y0) * scale * zoom_factor), self.window_size)
+        interpolation = cv2.INTER_AREA if scale * zoom_factor < 1 else cv2.INTER_LINEAR
+        display[:display_h, :display_w] = cv2.resize(region, (display_w, display_h), interpolation=interpolation)
+        return display
+
+    def update_image(self, x, y, zoom):
+        '''
+        Update the displayed image based on the trackbar positions and zoom level.
+        '''
+        self.current_x, self.current_y = x, y
+        self.zoom_level = max(zoom, self.min_zoom_level)  # Ensure zoom level is not below the minimum
+        cv2.imshow(self.window_name, self.render())
+
+    def on_trackbar(self, val):
+        '''
+        Callback function for trackbar.
+        '''
+        x = cv2.getTrackbarPos('X', self.window_name)
+        y = cv2.getTrackbarPos('Y', self.window_name)
+        zoom = cv2.getTrackbarPos('Zoom', self.window_name)
+
+        # Ensure the zoom level does not go below the minimum zoom level
+        if zoom < self.min_zoom_level:
+            zoom = self.min_zoom_level
+            cv2.setTrackbarPos('Zoom', self.window_name, self.min_zoom_level)
+
+        self.update_image(x, y, zoom)
+
+    def save_image_coordinates(self, event, x, y, flags, param):
+        '''
+        Mouse callback function to get coordinates relative to the full image.
+        '''
+        if event == cv2.EVENT_LBUTTONDOWN:
+            if self.max_clicks is None or len(self.clicks) < self.max_clicks:
+                # Calculate the coordinates relative to the full image
+                zoom_factor = self.zoom_level / 100.0
+                full_x = int(self.current_x + x / zoom_factor)
+                full_y = int(self.current_y + y / zoom_factor)
+                self.clicks.append((full_x, full_y))
+                print(f"Saved coordinates ({full_x}, {full_y})")
+
+    def show(self):
+        '''
+        Shows the image and waits until a key is pressed. Returns the list of clicks.
+        '''
+        cv2.imshow(self.window_name, self.render())
+        cv2.setMouseCallback(self.window_name, self.save_image_coordinates)
+
+        # Trackbars are created making it possible to change X, Y and Zoom.
+        # When the same viewer is shown again it opens where it was closed, and the tiles are still cached.
+        cv2.createTrackbar('X', self.window_name, self.current_x, max(0, self.width - self.window_size), self.on_trackbar)
+        cv2.createTrackbar('Y', self.window_name, self.current_y, max(0, self.height - self.window_size), self.on_trackbar)
+        cv2.createTrackbar('Zoom', self.window_name, self.zoom_level, 500, self.on_trackbar)  # Zoom range from 100% to 500%
+        cv2.waitKey(0)
+        cv2.destroyAllWindows()
+        return self.clicks
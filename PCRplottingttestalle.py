@@ -5,11 +5,12 @@ Created on Wed Oct 16 00:50:31 2024
 @author: User
 """
 
-import pandas as pd
 import matplotlib.pyplot as plt
 from scipy.stats import ttest_ind
 from itertools import combinations
 
+from ExcelLoader import read_excel
+
 # Set larger font sizes for all plot elements
 plt.rcParams.update({
     'font.size': 14,  # General font size
@@ -23,7 +24,7 @@ plt.rcParams.update({
 
 # Load the Excel file
 file_path = r'C:\Users\User\Desktop\Master\Polycarbonate\PCR\PCRMaster.xlsx'  # Replace with your actual file path
-df = pd.read_excel(file_path, sheet_name='Ark1')
+df = read_excel(file_path, sheet_name='Ark1')
 
 # Clean up the dataframe to focus on relevant columns
 df_cleaned = df[['Time', 'Sample', 'ValueAlpL', 'ValueRUNX2']].copy()
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+'''
+Counts the cells of the 64 fields in a pool of worker processes.
+
+The UV image is copied once into shared memory and every worker reads its fields
+directly from there, so only the field corners are sent between the processes
+and not the image data.
+
+Only call these functions from a script with an  if __name__ == "__main__":  guard,
+like BatchAnalyseAfPitsCellebilleder.py. On Windows every worker process imports
+the main script again, which would run an interactive script like
+AnalyseAfPitsCellebilleder.py once per worker.
+'''
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import cv2
+
+from PitsCellebilleder import count_cells_in_square_hsv, hsv_lower, hsv_upper
+
+# The shared UV image as seen from inside a worker process
+_shared_memory = None
+_shared_image = None
+
+
+def _attach_shared_image(name, shape, dtype):
+    '''
+    Initializer for the worker processes. Attaches to the shared UV image.
+    '''
+    global _shared_memory, _shared_image
+    # Every process counts one field at a time, so OpenCV should not start its own threads
+    cv2.setNumThreads(1)
+    _shared_memory = shared_memory.SharedMemory(name=name)
+    _shared_image = np.ndarray(shape, dtype=dtype, buffer=_shared_memory.buf)
+
+def _count_field(field):
+    '''
+    Counts the cells in one field of the shared UV image.
+    '''
+    x, y, square_size, lower, upper, parameters = field
+    square = _shared_image[y:y+square_size, x:x+square_size]
+    return count_cells_in_square_hsv(square, lower, upper, parameters)
+
+def count_cells_in_fields_parallel(UV_image, all_corners, square_size, hsv_lower=hsv_lower,
+                                   hsv_upper=hsv_upper, parameters=None, workers=None):
+    '''
+    Parallel version of count_cells_in_fields from PitsCellebilleder.py.
+
+    Parameters:
+    UV_image (numpy.ndarray): BGR UV image.
+    all_corners (list): Top left corner of every field.
+    square_size (int): Side length of a field in pixels.
+    parameters (dict, optional): Cell area parameters, see default_cell_area_parameters.
+    workers (int, optional): Number of worker processes. Defaults to the number of CPUs.
+
+    Returns:
+    dict: The top left corner of each field as key and the cell count as value.
+    '''
+    if workers is None:
+        workers = os.cpu_count()
+
+    shm = shared_memory.SharedMemory(create=True, size=UV_image.nbytes)
+    try:
+        shared_image = np.ndarray(UV_image.shape, dtype=UV_image.dtype, buffer=shm.buf)
+        shared_image[:] = UV_image
+
+        fields = [(x, y, square_size, hsv_lower, hsv_upper, parameters) for (x, y) in all_corners]
+        with ProcessPoolExecutor(max_workers=workers, initializer=_attach_shared_image,
+                                 initargs=(shm.name, UV_image.shape, UV_image.dtype)) as executor:
+            counts = list(executor.map(_count_field, fields, chunksize=max(1, len(fields) // (4 * workers))))
+        del shared_image
+    finally:
+        shm.close()
+        shm.unlink()
+
+    return dict(zip(all_corners, counts))
@@ -0,0 +1,793 @@
+# -*- coding: utf-8 -*-
+'''
+Python version of the ImageJ macros cellcount.ijm and cellcountbright.ijm, so the
+particle analysis can run without Fiji.
+
+For every TIF file in a folder the image is converted to 8-bit, thresholded with
+an automatic threshold (Triangle in cellcount.ijm, IJ_IsoData in
+cellcountbright.ijm), median filtered with a radius of 2, split with a watershed on
+the distance map and the particles with an area of 20-100 are measured. The same
+files as the macros are written:
+
+    <name>_results.csv          X, Y, Area and Circularity of every particle
+    <name>_overlay.tif          Outline of the particles (only with overlay=True)
+    <first name>_summary_results.csv
+                                Average area, average circularity and particle
+                                count of every file
+
+The particles of many folders can also be saved in one Parquet dataset, see
+analyse_directory and load_particle_dataset.
+
+The thresholds, the median filter and the measurements follow ImageJ. The
+watershed finds the same kind of split points (maxima of the distance map that are
+more than 0.5 pixel higher than their surroundings), but the split lines can be
+placed a pixel differently than in ImageJ, so single particles can differ slightly.
+
+Unlike the macros, analyse_directory can analyse the files in parallel and skips
+files analysed in an earlier run that have not changed since.
+'''
+
+import hashlib
+import json
+import math
+import os
+import zlib
+from functools import partial
+
+import numpy as np
+import pandas as pd
+import cv2
+
+from BatchRunner import run_jobs
+
+# Area and circularity of the particles that are kept, the same as in the macros
+default_size = (20, 100)
+default_circularity = (0.0, 1.0)
+
+# Columns of _results.csv, the same as in the macros
+result_columns = ['X', 'Y', 'Area', 'Circularity']
+
+# Columns added to _results.csv with extended=True, named like in the ImageJ Results table
+extended_columns = ['Perim.', 'BX', 'BY', 'Width', 'Height', 'Major', 'Minor', 'Angle', 'AR', 'Round', 'Solidity',
+                    'Feret', 'Mean', 'StdDev', 'Min', 'Max', 'Median', 'IntDen']
+
+# Saved in the folder by analyse_directory, so files that did not change are skipped next time
+cache_file_name = 'Zbehandlet - Particle analysis.json'
+
+
+# Automatic thresholds, ported from ij.process.AutoThresholder
+def threshold_triangle(histogram):
+    '''
+    ImageJ's Triangle threshold of a 256 bin histogram.
+    '''
+    data = list(histogram)
+    n = len(data)
+    # Find min and max
+    minimum = next((i for i in range(n) if data[i] > 0), 0)
+    if minimum > 0:
+        minimum -= 1  # line to the (p==0) point, not to data[min]
+    minimum2 = next((i for i in range(n - 1, 0, -1) if data[i] > 0), 0)
+    if minimum2 < n - 1:
+        minimum2 += 1  # line to the (p==0) point, not to data[min]
+    maximum = int(np.argmax(data))
+
+    # Find which is the furthest side
+    inverted = False
+    if (maximum - minimum) < (minimum2 - maximum):
+        # Reverse the histogram
+        inverted = True
+        data = data[::-1]
+        minimum = n - 1 - minimum2
+        maximum = n - 1 - maximum
+    if minimum == maximum:
+        return minimum
+
+    # Describe line by nx * x + ny * y - d = 0
+    nx = data[maximum]
+    ny = minimum - maximum
+    d = math.sqrt(nx * nx + ny * ny)
+    nx /= d
+    ny /= d
+    d = nx * minimum + ny * data[minimum]
+
+    # Find split point
+    split = minimum
+    split_distance = 0
+    for i in range(minimum + 1, maximum + 1):
+        new_distance = nx * i + ny * data[i] - d
+        if new_distance > split_distance:
+            split = i
+            split_distance = new_distance
+    split -= 1
+    return n - 1 - split if inverted else split
+
+def threshold_ij_isodata(histogram):
+    '''
+    ImageJ's IJ_IsoData threshold of a 256 bin histogram (the original ImageJ IsoData).
+    '''
+    data = [int(count) for count in histogram]
+    max_value = len(data) - 1
+    # The first and last bin are left out, so erased areas are not included
+    data[0] = 0
+    data[max_value] = 0
+    minimum = 0
+    while data[minimum] == 0 and minimum < max_value:
+        minimum += 1
+    maximum = max_value
+    while data[maximum] == 0 and maximum > 0:
+        maximum -= 1
+    if minimum >= maximum:
+        return len(data) // 2
+
+    moving_index = minimum
+    while True:
+        sum1 = sum(i * data[i] for i in range(minimum, moving_index + 1))
+        sum2 = sum(data[minimum:moving_index + 1])
+        sum3 = sum(i * data[i] for i in range(moving_index + 1, maximum + 1))
+        sum4 = sum(data[moving_index + 1:maximum + 1])
+        result = (sum1 / sum2 + sum3 / sum4) / 2.0
+        moving_index += 1
+        if not ((moving_index + 1) <= result and moving_index < maximum - 1):
+            break
+    # Java's Math.round rounds halves up
+    return int(math.floor(result + 0.5))
+
+# Threshold methods that can be chosen, named as in ImageJ's setAutoThreshold
+threshold_methods = {'Triangle': threshold_triangle,
+                     'IJ_IsoData': threshold_ij_isodata}
+
+
+def to_8bit(image):
+    '''
+    Converts an image to 8-bit like run("8-bit") in ImageJ. Colour images become the
+    unweighted mean of the channels, and 16-bit and 32-bit images are scaled from
+    their minimum to their maximum.
+    '''
+    if image.ndim == 3:
+        return np.floor(image[:, :, :3].astype(np.float64).mean(axis=2) + 0.5).astype(np.uint8)
+    if image.dtype == np.uint8:
+        return image
+    minimum, maximum = float(image.min()), float(image.max())
+    if image.dtype == np.uint16:
+        scale = 256.0 / (maximum - minimum + 1)
+    else:
+        scale = 255.0 / (maximum - minimum) if maximum > minimum else 1.0
+    return np.clip(np.floor((image - minimum) * scale + 0.5), 0, 255).astype(np.uint8)
+
+def threshold_mask(image, method='Triangle'):
+    '''
+    setAutoThreshold("<method> dark") followed by "Convert to Mask" with a black
+    background: pixels above the threshold become 255, the rest 0.
+    '''
+    if method not in threshold_methods:
+        raise ValueError(f'Unknown threshold method {method}, choose one of {list(threshold_methods)}')
+    histogram = np.bincount(image.ravel(), minlength=256)
+    threshold = threshold_methods[method](histogram)
+    return np.where(image > threshold, 255, 0).astype(np.uint8)
+
+def circular_kernel(radius):
+    '''
+    The circular kernel of ImageJ's rank filters (Median..., Minimum... etc.).
+    '''
+    r2 = int(radius * radius) + 1
+    size = int(math.sqrt(r2 + 1e-10))
+    kernel = np.zeros((2 * size + 1, 2 * size + 1), np.uint8)
+    for dy in range(-size, size + 1):
+        dx = int(math.sqrt(r2 - dy * dy + 1e-10))
+        kernel[size + dy, size - dx:size + dx + 1] = 1
+    return kernel
+
+def median_mask(mask, radius=2):
+    '''
+    run("Median...", "radius=2") on a mask. For a mask the median is 255 where more
+    than half of the pixels in the circular kernel are 255. Pixels outside the image
+    are taken from the nearest edge pixel like in ImageJ.
+    '''
+    kernel = circular_kernel(radius)
+    counts = cv2.filter2D((mask > 0).astype(np.float32), -1, kernel.astype(np.float32),
+                          borderType=cv2.BORDER_REPLICATE)
+    return np.where(counts > kernel.sum() / 2, 255, 0).astype(np.uint8)
+
+def _reconstruct(marker, mask):
+    '''
+    Morphological reconstruction by dilation of marker below mask.
+    '''
+    kernel = np.ones((3, 3), np.uint8)
+    while True:
+        expanded = np.minimum(cv2.dilate(marker, kernel), mask)
+        if np.array_equal(expanded, marker):
+            return marker
+        marker = expanded
+
+def _neighbour_offsets(width):
+    '''
+    Offsets of the 8 neighbours of a pixel in a flattened image of the given width.
+    '''
+    return np.array([-width - 1, -width, -width + 1, -1, 1, width - 1, width, width + 1])
+
+def _single_neighbour_label(labels, pixels, offsets):
+    '''
+    For every pixel (index in the flattened labels): the label of the particle it
+    touches, or 0 if it touches no particle, and if it touches only that one particle.
+    '''
+    neighbours = labels[pixels[:, None] + offsets]
+    highest = neighbours.max(axis=1)
+    lowest = np.where(neighbours > 0, neighbours, np.iinfo(labels.dtype).max).min(axis=1)
+    return highest, highest == lowest
+
+def watershed_labels(mask, tolerance=0.5, level_step=0.5):
+    '''
+    Splits touching particles like run("Watershed") in ImageJ and returns a label
+    image (0 is background, every particle has its own number above 0).
+
+    The distance from every particle pixel to the background is calculated, and
+    every maximum of the distance map which is more than tolerance higher than the
+    saddle to a higher maximum becomes its own particle. The particles are grown from
+    the maxima level by level (level_step apart in pixels of distance), and pixels
+    touching two particles are left out so the particles are separated by a one
+    pixel wide line like in ImageJ.
+
+    Only the pixels that are still free are looked at when growing, so the time
+    depends on the number of particle pixels and not on how deep the distance map is.
+    '''
+    foreground = mask > 0
+    # Pixels outside the image count as background
+    distance = cv2.distanceTransform(cv2.copyMakeBorder(foreground.astype(np.uint8), 1, 1, 1, 1,
+                                                        cv2.BORDER_CONSTANT, value=0),
+                                     cv2.DIST_L2, cv2.DIST_MASK_PRECISE)[1:-1, 1:-1]
+
+    # Maxima higher than tolerance: the distance map with every peak cut tolerance
+    # lower has flat tops, and maxima closer than tolerance to each other share a top
+    cut = _reconstruct(np.maximum(distance - tolerance, 0), distance)
+    maxima = foreground & (cut - _reconstruct(np.maximum(cut - 1e-3, 0), cut) > 0)
+    _, markers = cv2.connectedComponents(maxima.astype(np.uint8), connectivity=8)
+
+    # The labels are kept flattened with a border of background, so the neighbours of
+    # a list of pixels are found by adding the offsets to their indices
+    labels = np.pad(markers.astype(np.int32), 1).ravel()
+    offsets = _neighbour_offsets(foreground.shape[1] + 2)
+    padded_distance = np.pad(distance, 1).ravel().astype(np.float64)
+
+    # The free pixels from the highest to the lowest distance
+    pixels = np.flatnonzero(np.pad(foreground & ~maxima, 1))
+    pixels = pixels[np.argsort(-padded_distance[pixels], kind='stable')]
+    negative_distance = -padded_distance[pixels]
+
+    # The particles are grown from the maxima one level of the distance map at a time,
+    # from the highest level down. A pixel is only given to a particle if it touches no
+    # other particle, pixels touching two particles stay as the line between them
+    free = pixels[:0]
+    added = 0
+    for level in np.arange(np.floor(distance.max() / level_step) * level_step, 0, -level_step):
+        reached = np.searchsorted(negative_distance, -level, side='right')
+        free = np.concatenate([free, pixels[added:reached]])
+        added = reached
+        while len(free):
+            highest, single = _single_neighbour_label(labels, free, offsets)
+            touching = highest > 0
+            if not touching.any():
+                break
+            labels[free[touching & single]] = highest[touching & single]
+            free = free[~touching]
+
+    # Particles touching each other after growing in the same step are separated by
+    # removing the pixels of the lower particle that touch a higher one
+    labelled = np.flatnonzero(labels)
+    labels[labelled[labels[labelled[:, None] + offsets].max(axis=1) > labels[labelled]]] = 0
+
+    # The lines are then thinned to one pixel: a line pixel touching only one particle
+    # is given back to it. The pixels are handled in 9 groups 3 pixels apart, so two
+    # neighbouring line pixels are never given to two different particles at once
+    line = np.flatnonzero(np.pad(foreground, 1).ravel() & (labels == 0))
+    rows, columns = np.divmod(line, foreground.shape[1] + 2)
+    groups = rows % 3 * 3 + columns % 3
+    changed = True
+    while changed:
+        changed = False
+        for group in range(9):
+            candidates = line[groups == group]
+            highest, single = _single_neighbour_label(labels, candidates, offsets)
+            given = (highest > 0) & single
+            if given.any():
+                labels[candidates[given]] = highest[given]
+                changed = True
+        still_line = labels[line] == 0
+        line, groups = line[still_line], groups[still_line]
+
+    return labels.reshape(foreground.shape[0] + 2, -1)[1:-1, 1:-1].copy()
+
+def traced_perimeter(region):
+    '''
+    Perimeter of a particle like ImageJ measures it. The outline of the particle is
+    traced along the pixel edges (8-connected, like the ImageJ Wand), and edge pixels
+    count as 1 and corner pixels as sqrt(2).
+
+    Parameters:
+    region (numpy.ndarray): Boolean mask holding only the particle.
+    '''
+    padded = np.pad(region, 1)
+    ys, xs = np.nonzero(padded)
+    # The first pixel in raster order, the outline starts at its top left corner going right
+    start = (int(xs[0]), int(ys[0]))
+
+    def pixel(x, y):
+        return padded[y, x]
+
+    # Directions in image coordinates (y down), turning right is the next direction
+    directions = [(1, 0), (0, 1), (-1, 0), (0, -1)]
+    x, y = start
+    direction = 0
+    vertices = []
+    while True:
+        dx, dy = directions[direction]
+        x, y = x + dx, y + dy
+        # Pixels ahead of the current edge, to the left and to the right of it
+        if direction == 0:
+            ahead_left, ahead_right = pixel(x, y - 1), pixel(x, y)
+        elif direction == 1:
+            ahead_left, ahead_right = pixel(x, y), pixel(x - 1, y)
+        elif direction == 2:
+            ahead_left, ahead_right = pixel(x - 1, y), pixel(x - 1, y - 1)
+        else:
+            ahead_left, ahead_right = pixel(x - 1, y - 1), pixel(x, y - 1)
+        if ahead_left:
+            new_direction = (direction + 3) % 4
+        elif ahead_right:
+            new_direction = direction
+        else:
+            new_direction = (direction + 1) % 4
+        if new_direction != direction:
+            vertices.append((x, y))
+        direction = new_direction
+        if (x, y) == start and direction == 0:
+            break
+
+    # ImageJ's PolygonRoi.getTracedPerimeter
+    n = len(vertices)
+    sum_dx = sum_dy = corners = 0
+    dx1 = vertices[0][0] - vertices[n - 1][0]
+    dy1 = vertices[0][1] - vertices[n - 1][1]
+    side1 = abs(dx1) + abs(dy1)
+    corner = False
+    for i in range(n):
+        next_i = (i + 1) % n
+        dx2 = vertices[next_i][0] - vertices[i][0]
+        dy2 = vertices[next_i][1] - vertices[i][1]
+        sum_dx += abs(dx1)
+        sum_dy += abs(dy1)
+        side2 = abs(dx2) + abs(dy2)
+        if side1 > 1 or not corner:
+            corner = True
+            corners += 1
+        else:
+            corner = False
+        dx1, dy1, side1 = dx2, dy2, side2
+    return sum_dx + sum_dy - corners * (2.0 - math.sqrt(2.0))
+
+def extended_measurements(xs, ys, region, perimeter, pixel_size, image=None):
+    '''
+    The measurements in extended_columns of one particle, calculated like ImageJ
+    does. The intensities are taken from image (the 8-bit image) if it is given.
+
+    Parameters:
+    xs, ys (numpy.ndarray): Coordinates of the pixels of the particle.
+    region (numpy.ndarray): Boolean mask holding only the particle.
+    perimeter (float): Perimeter from traced_perimeter, in calibrated units.
+    '''
+    area = len(xs) * pixel_size ** 2
+    x0, y0 = xs.min(), ys.min()
+    measurements = {'Perim.': perimeter, 'BX': x0 * pixel_size, 'BY': y0 * pixel_size,
+                    'Width': region.shape[1] * pixel_size, 'Height': region.shape[0] * pixel_size}
+
+    # Ellipse with the same area and second moments as the particle (ImageJ's EllipseFitter)
+    moments = cv2.moments(region.astype(np.uint8), binaryImage=True)
+    # Every pixel is a square, which adds 1/12 to the second moments
+    xx = moments['mu20'] / moments['m00'] + 1 / 12
+    yy = moments['mu02'] / moments['m00'] + 1 / 12
+    xy = moments['mu11'] / moments['m00']
+    root = math.sqrt((xx - yy) ** 2 + 4 * xy ** 2)
+    major = math.sqrt(2 * (xx + yy + root))
+    minor = math.sqrt(max(2 * (xx + yy - root), 0))
+    # Scaled so the ellipse has the area of the particle
+    scale = math.sqrt(len(xs) / (math.pi * major * minor / 4)) if minor > 0 else 1
+    major, minor = major * scale * pixel_size, minor * scale * pixel_size
+    # Counterclockwise from the x axis like in ImageJ, where y points down
+    angle = math.degrees(-0.5 * math.atan2(2 * xy, xx - yy)) % 180
+    measurements.update({'Major': major, 'Minor': minor, 'Angle': angle, 'AR': major / minor if minor > 0 else 0,
+                         'Round': 4 * area / (math.pi * major ** 2) if major > 0 else 0})
+
+    # Convex hull of the pixel corners, for the solidity and the Feret diameter
+    corners = np.concatenate([np.stack([xs + dx, ys + dy], axis=1) for dx in (0, 1) for dy in (0, 1)])
+    hull = cv2.convexHull(corners.astype(np.float32))[:, 0]
+    measurements['Solidity'] = len(xs) / cv2.contourArea(hull)
+    measurements['Feret'] = math.sqrt(((hull[:, None] - hull[None]) ** 2).sum(axis=2).max()) * pixel_size
+
+    if image is not None:
+        values = image[ys, xs].astype(np.float64)
+        measurements.update({'Mean': values.mean(), 'StdDev': values.std(ddof=1) if len(values) > 1 else 0,
+                             'Min': values.min(), 'Max': values.max(), 'Median': np.median(values),
+                             'IntDen': values.mean() * area})
+    return measurements
+
+def measure_particles(labels, size=default_size, circularity=default_circularity, pixel_size=1.0,
+                      extended=False, image=None):
+    '''
+    run("Analyze Particles...", "size=20-100 circularity=0.00-1.00") on a label image.
+
+    Parameters:
+    size (tuple): Smallest and largest area that is kept.
+    circularity (tuple): Smallest and largest circularity that is kept.
+    pixel_size (float): Width of a pixel, if the images are spatially calibrated in
+        ImageJ. X, Y, Area and the size limits are then in the calibrated unit.
+    extended (bool): Also measure extended_columns, see extended_measurements.
+    image (numpy.ndarray, optional): 8-bit image the intensities are measured in.
+
+    Returns:
+    list: A dictionary with X, Y, Area and Circularity (and extended_columns) for
+    every particle, in the order ImageJ finds them (by the top left pixel of the particle).
+    '''
+    # The pixels of every particle in raster order, found with one sort instead of
+    # searching the image once per particle
+    flat_labels = labels.ravel()
+    pixel_order = np.argsort(flat_labels, kind='stable')
+    ends = np.cumsum(np.bincount(flat_labels))
+
+    particles = []
+    for label in range(1, len(ends)):
+        pixels = pixel_order[ends[label - 1]:ends[label]]
+        if len(pixels) == 0:
+            continue
+        area = len(pixels) * pixel_size ** 2
+        if not size[0] <= area <= size[1]:
+            continue
+        ys, xs = np.divmod(pixels, labels.shape[1])
+        region = labels[ys.min():ys.max() + 1, xs.min():xs.max() + 1] == label
+        perimeter = traced_perimeter(region) * pixel_size
+        particle_circularity = min(4 * math.pi * area / perimeter ** 2, 1.0) if perimeter > 0 else 0.0
+        if not circularity[0] <= particle_circularity <= circularity[1]:
+            continue
+        particle = {'X': (xs.mean() + 0.5) * pixel_size, 'Y': (ys.mean() + 0.5) * pixel_size,
+                    'Area': area, 'Circularity': particle_circularity, '_first_pixel': pixels[0]}
+        if extended:
+            particle.update(extended_measurements(xs, ys, region, perimeter, pixel_size, image))
+        particles.append(particle)
+
+    # ImageJ finds the particles row by row, by the top left pixel of the particle
+    particles.sort(key=lambda particle: particle.pop('_first_pixel'))
+    return particles
+
+def outline(mask):
+    '''
+    run("Outline") on a mask: only particle pixels next to the background are kept.
+    '''
+    foreground = (mask > 0).astype(np.uint8)
+    cross = cv2.getStructuringElement(cv2.MORPH_CROSS, (3, 3))
+    interior = cv2.erode(foreground, cross, borderType=cv2.BORDER_CONSTANT, borderValue=0)
+    return np.where(foreground & ~interior.astype(bool), 255, 0).astype(np.uint8)
+
+def overlay_image(labels, scale=1.0):
+    '''
+    The _overlay.tif image: the outline of the particles. With scale below 1 the
+    overlay is made smaller, and a pixel is part of the outline if any of the
+    pixels it covers is.
+    '''
+    overlay = outline(labels)
+    if scale != 1.0:
+        size = (max(1, round(overlay.shape[1] * scale)), max(1, round(overlay.shape[0] * scale)))
+        overlay = np.where(cv2.resize(overlay, size, interpolation=cv2.INTER_AREA) > 0, 255, 0).astype(np.uint8)
+    return overlay
+
+def analyse_image(image, method='Triangle', size=default_size, circularity=default_circularity, pixel_size=1.0,
+                  extended=False):
+    '''
+    The image processing of the macros on one image. extended is passed on to
+    measure_particles, the intensities are measured in the 8-bit image.
+
+    Returns:
+    tuple: (particles from measure_particles, label image)
+    '''
+    image = to_8bit(image)
+    mask = threshold_mask(image, method)
+    mask = median_mask(mask, radius=2)
+    labels = watershed_labels(mask)
+    return measure_particles(labels, size, circularity, pixel_size, extended, image), labels
+
+def format_number(value):
+    '''
+    Writes a number like the ImageJ macro language does when it is added to a string:
+    whole numbers without decimals, other numbers with 4 decimals.
+    '''
+    if value == int(value) and abs(value) < 1e9:
+        return str(int(value))
+    return f'{value:.4f}'
+
+def base_name(file_name):
+    '''
+    The file name up to the first '.', like substring(name, 0, indexOf(name, ".")).
+    '''
+    return file_name[:file_name.index('.')]
+
+def write_results(particles, output_path, columns=result_columns):
+    '''
+    Writes <name>_results.csv.
+    '''
+    with open(output_path, 'w', newline='') as f:
+        f.write(','.join(columns) + '\n')
+        for particle in particles:
+            f.write(','.join(format_number(particle.get(key, 0)) for key in columns) + '\n')
+
+def summary_line(file_name, particles):
+    '''
+    The line of a file in _summary_results.csv.
+    '''
+    counts = len(particles)
+    average_area = sum(particle['Area'] for particle in particles) / counts if counts else 0
+    average_circularity = sum(particle['Circularity'] for particle in particles) / counts if counts else 0
+    return f'{file_name},{format_number(average_area)},{format_number(average_circularity)},{counts}\n'
+
+def tif_files(input_dir):
+    '''
+    The TIF files of a folder in the order ImageJ's getFileList gives them. Overlays
+    written by an earlier run are left out.
+    '''
+    return sorted(name for name in os.listdir(input_dir)
+                  if name.endswith(('.tif', '.TIF')) and not base_name(name).endswith('_overlay'))
+
+def output_paths(input_dir, file_name, overlay=True, results_csv=True):
+    '''
+    The files analyse_file writes for a TIF file.
+    '''
+    name = base_name(file_name)
+    paths = []
+    if results_csv:
+        paths.append(os.path.join(input_dir, name + '_results.csv'))
+    if overlay:
+        paths.append(os.path.join(input_dir, name + '_overlay.tif'))
+    return paths
+
+def wants_overlay(file_name, overlay_every):
+    '''
+    True if the file is in the sample getting an overlay, about one in overlay_every
+    files. The sample depends only on the file name, so it stays the same when files
+    are added to the folder.
+    '''
+    return zlib.crc32(file_name.encode()) % overlay_every == 0
+
+def analyse_file(input_dir, file_name, method='Triangle', size=default_size, circularity=default_circularity,
+                 pixel_size=1.0, extended=False, overlay=False, overlay_scale=1.0, results_csv=True):
+    '''
+    Analyses one TIF file and writes its _results.csv (unless results_csv is False),
+    with extended_columns if extended is True. With overlay the outline of the
+    particles is saved as _overlay.tif, made smaller by overlay_scale.
+
+    Returns:
+    tuple: (its line in _summary_results.csv, particles from measure_particles)
+    '''
+    image = cv2.imread(os.path.join(input_dir, file_name), cv2.IMREAD_UNCHANGED)
+    if image is None:
+        raise FileNotFoundError(f'Error loading {os.path.join(input_dir, file_name)}')
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    particles, labels = analyse_image(image, method, size, circularity, pixel_size, extended)
+
+    paths = output_paths(input_dir, file_name, overlay, results_csv)
+    if results_csv:
+        write_results(particles, paths[0], result_columns + extended_columns if extended else result_columns)
+    if overlay:
+        cv2.imwrite(paths[-1], overlay_image(labels, overlay_scale))
+    return summary_line(file_name, particles), particles
+
+def particle_table(file_name, particles, extended=False):
+    '''
+    The particles of a file as a DataFrame with a row per particle and the columns
+    file, X, Y, Area and Circularity (and extended_columns if extended is True).
+    A file without particles gets one row with empty (NaN) measurements, so the
+    file is still in the dataset and counts as 0 in summary_from_dataset.
+    '''
+    columns = result_columns + extended_columns if extended else result_columns
+    rows = [[particle.get(key, 0) for key in columns] for particle in particles]
+    table = pd.DataFrame(rows or [[np.nan] * len(columns)], columns=columns, dtype=float)
+    table.insert(0, 'file', file_name)
+    return table
+
+def dataset_part_path(dataset_dir, experiment, input_dir):
+    '''
+    The Parquet file holding the particles of a folder in a particle dataset. The
+    dataset has a folder per experiment ('experiment=<name>', so pandas and pyarrow
+    read the experiment as a column) with a file per analysed folder.
+    '''
+    return os.path.join(dataset_dir, f'experiment={experiment}',
+                        os.path.basename(os.path.normpath(input_dir)) + '.parquet')
+
+def load_particle_dataset(dataset_dir, experiments=None):
+    '''
+    Reads a particle dataset written by analyse_directory in one go, optionally only
+    the given experiments. Returns a DataFrame with a row per particle and the
+    columns experiment, file, X, Y, Area, Circularity ... Files without particles
+    have a row with empty measurements, particles.dropna(subset=['Area']) leaves
+    only the particles.
+    '''
+    filters = None if experiments is None else [('experiment', 'in', list(experiments))]
+    particles = pd.read_parquet(dataset_dir, filters=filters)
+    particles['experiment'] = particles['experiment'].astype(str)
+    return particles
+
+def summary_from_dataset(particles):
+    '''
+    The _summary_results.csv table of every file in a particle dataset, found with a
+    group-by on the table from load_particle_dataset. Files without any particles
+    have a particle count of 0 and averages of 0, like in _summary_results.csv.
+    '''
+    # count skips the empty row of a file without particles
+    return (particles.groupby(['experiment', 'file'], observed=True)
+            .agg(**{'Average Area': ('Area', 'mean'), 'Average Circularity': ('Circularity', 'mean'),
+                    'Particle Count': ('Area', 'count')})
+            .fillna({'Average Area': 0, 'Average Circularity': 0})
+            .reset_index())
+
+def file_hash(file_path):
+    '''
+    sha1 of the content of a file.
+    '''
+    sha1 = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+def load_cache(input_dir):
+    '''
+    Loads the cache file of a folder, see analyse_directory. An empty cache is
+    returned if the folder has none.
+    '''
+    cache_path = os.path.join(input_dir, cache_file_name)
+    if not os.path.exists(cache_path):
+        return {}
+    with open(cache_path, 'r') as f:
+        return json.load(f)
+
+def save_cache(input_dir, cache):
+    '''
+    Saves the cache file of a folder. It is written to a temporary file first, so an
+    interrupted run does not leave half a cache.
+    '''
+    cache_path = os.path.join(input_dir, cache_file_name)
+    with open(cache_path + '.tmp', 'w') as f:
+        json.dump(cache, f, indent=4)
+    os.replace(cache_path + '.tmp', cache_path)
+
+def is_up_to_date(input_dir, file_name, entry, settings):
+    '''
+    True if the saved outputs of a file can be used instead of analysing it again:
+    it was analysed with the same settings, the outputs still exist and they are
+    newer than the file. If the file is newer (e.g. copied again), the content
+    hash decides.
+    '''
+    if entry is None or entry['settings'] != settings:
+        return False
+    paths = output_paths(input_dir, file_name, settings['overlay'], settings['results_csv'])
+    if not all(os.path.exists(path) for path in paths):
+        return False
+    file_path = os.path.join(input_dir, file_name)
+    if paths and min(os.path.getmtime(path) for path in paths) >= os.path.getmtime(file_path):
+        return True
+    return file_hash(file_path) == entry['hash']
+
+def _analyse_file_job(input_dir, settings, file_name):
+    '''
+    analyse_file as a job for run_jobs. Returns the cache entry and the particles of the file.
+    '''
+    summary, particles = analyse_file(input_dir, file_name, **settings[file_name])
+    return {'hash': file_hash(os.path.join(input_dir, file_name)), 'summary': summary}, particles
+
+def analyse_directory(input_dir, method='Triangle', size=default_size, circularity=default_circularity,
+                      pixel_size=1.0, workers=1, overwrite=False, extended=False, overlay=False, overlay_every=1,
+                      overlay_scale=1.0, dataset_dir=None, experiment=None, results_csv=True):
+    '''
+    Does what cellcount.ijm (method='Triangle') or cellcountbright.ijm
+    (method='IJ_IsoData') does for a folder. Returns the path of the summary file.
+
+    The summary line and content hash of every analysed file are saved in
+    'Zbehandlet - Particle analysis.json' in the folder. When the folder is analysed
+    again, files that are up to date (see is_up_to_date) are skipped and their
+    summary line is taken from the cache, so only new or changed files are
+    analysed. overwrite analyses every file again.
+
+    With workers above 1 that many files are analysed at the same time, each in its
+    own process. A file that fails is reported at the end and left out of the summary.
+
+    The overlays are only saved with overlay=True, and then only for a sample of
+    about one in overlay_every files (see wants_overlay), made smaller by
+    overlay_scale. extended adds extended_columns to the _results.csv files.
+
+    With dataset_dir the particles of all files are also saved in one Parquet file in
+    a particle dataset (see dataset_part_path), under experiment (the name of the
+    folder if it is not given). The dataset of many folders is read in one go with
+    load_particle_dataset, so results_csv=False can be used to skip the
+    _results.csv files.
+    '''
+    file_names = tif_files(input_dir)
+    # The settings used for every file, a file is analysed again if they change
+    settings = {file_name: {'method': method, 'size': list(size), 'circularity': list(circularity),
+                            'pixel_size': pixel_size, 'extended': extended,
+                            'overlay': overlay and wants_overlay(file_name, overlay_every),
+                            'overlay_scale': overlay_scale, 'results_csv': results_csv}
+                for file_name in file_names}
+    old_cache = {} if overwrite else load_cache(input_dir)
+
+    if dataset_dir is not None:
+        if experiment is None:
+            experiment = os.path.basename(os.path.normpath(input_dir))
+        part_path = dataset_part_path(dataset_dir, experiment, input_dir)
+        # The particles of skipped files are taken from the saved dataset, so without it
+        # every file is analysed again
+        if os.path.exists(part_path):
+            saved_particles = pd.read_parquet(part_path)
+            # Files missing from the saved dataset (e.g. files without particles in a
+            # dataset from before they got a row) are analysed again
+            saved_files = set(saved_particles['file'])
+            old_cache = {file_name: entry for file_name, entry in old_cache.items() if file_name in saved_files}
+        else:
+            old_cache = {}
+    cache = {file_name: old_cache[file_name] for file_name in file_names
+             if is_up_to_date(input_dir, file_name, old_cache.get(file_name), settings[file_name])}
+    to_analyse = [file_name for file_name in file_names if file_name not in cache]
+    print(f'{len(to_analyse)} of {len(file_names)} files are analysed, the rest are up to date')
+
+    results, _ = run_jobs(partial(_analyse_file_job, input_dir, settings), to_analyse, workers, what='files',
+                          done='analysed')
+    tables = []
+    for file_name, (entry, particles) in results:
+        cache[file_name] = dict(entry, settings=settings[file_name])
+        if dataset_dir is not None:
+            tables.append(particle_table(file_name, particles, extended))
+
+    if dataset_dir is not None:
+        skipped = [file_name for file_name in file_names if file_name in cache and file_name not in to_analyse]
+        if skipped:
+            tables.append(saved_particles[saved_particles['file'].isin(skipped)])
+        table = pd.concat(tables, ignore_index=True) if tables else particle_table('', [], extended).iloc[:0]
+        os.makedirs(os.path.dirname(part_path), exist_ok=True)
+        # Written to a temporary file first, so an interrupted run does not leave half a file
+        table.sort_values('file', kind='stable').to_parquet(part_path + '.tmp', index=False)
+        os.replace(part_path + '.tmp', part_path)
+        print(f'Particles saved to: {part_path}')
+    save_cache(input_dir, cache)
+
+    summary_results = 'File,Average Area,Average Circularity,Particle Count\n'
+    for file_name in file_names:
+        if file_name in cache:
+            summary_results += cache[file_name]['summary']
+
+    # Save the summary results to a CSV file in the same folder as the TIF files
+    first_base_name = base_name(file_names[0]) if file_names else ''
+    summary_output_file = os.path.join(input_dir, first_base_name + '_summary_results.csv')
+    with open(summary_output_file, 'w', newline='') as f:
+        f.write(summary_results)
+    print(f'Results saved to: {summary_output_file}')
+    return summary_output_file
+
+# Example usage
+if __name__ == "__main__":
+    # Folder with the TIF files
+    input_dir = r'C:\Users\User\Desktop\Master\29_5\Ti'
+
+    # Number of files analysed at the same time, os.cpu_count() uses every core
+    workers = os.cpu_count()
+
+    # Overlays are only saved if overlay is True, for one in overlay_every files and at
+    # overlay_scale of the full size. extended adds the other ImageJ measurements to _results.csv
+    overlay = False
+    overlay_every = 1
+    overlay_scale = 1.0
+    extended = False
+
+    # Folder of the particle dataset shared by all experiments, None saves no dataset.
+    # results_csv = False skips the _results.csv of every file
+    dataset_dir = None
+    results_csv = True
+
+    # 'Triangle' does the same as cellcount.ijm and 'IJ_IsoData' the same as cellcountbright.ijm
+    analyse_directory(input_dir, method='Triangle', workers=workers, extended=extended, overlay=overlay,
+                      overlay_every=overlay_every, overlay_scale=overlay_scale, dataset_dir=dataset_dir,
+                      results_csv=results_csv)
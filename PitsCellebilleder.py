@@ -0,0 +1,643 @@
+# -*- coding: utf-8 -*-
+'''
+Shared functions for the pit/field cell counting scripts.
+
+AnalyseAfPitsCellebilleder.py, RotationAfCellebilleder.py and
+BatchAnalyseAfPitsCellebilleder.py all import from here, so the interactive
+scripts and the unattended batch run count cells in exactly the same way.
+Nothing in this file opens windows or asks for input.
+'''
+
+import json
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import cv2
+import openpyxl
+
+# Dictionary which contain the orientation of masters used.
+# An item consist of the key, which is given as a master name (like M5 for amster 5)
+# and a value, which will be the orientation of the master. See attatched images in
+# the script folder and match these to the master using a microscope.
+# Possibilities for oritentations are: N, W, S and E.
+master_dictionary = {'W': 'W', 'M7':'W'}
+
+# File names used inside every sample folder
+BF_image_name = 'BF.tif'
+UV_image_name = 'UV.tif'
+rotated_BF_image_name = 'Zbehandlet - Rotated BF image.tif'
+rotated_UV_image_name = 'Zbehandlet - Rotated UV image.tif'
+calibration_file_name = 'Zbehandlet - Kalibrering.json'
+
+# The space between fields in pixels (2.5 mm on the 4x images)
+inter_space_pixels = 157
+
+# Default HSV range for cell detection
+hsv_lower = np.array([0, 0, 0])
+hsv_upper = np.array([31, 31, 31])
+
+# Parameters for cell area in pixels. A contour smaller than minimum_area or larger
+# than too_large_area is not counted, a contour larger than connected_cell_area
+# is counted as area / average_cell_area cells and everything in between as one cell.
+default_cell_area_parameters = {'minimum_area': 10, 'average_cell_area': 60,
+                                'connected_cell_area': 150, 'too_large_area': 200}
+
+# The cells change size during the experiment, so the parameters can be set for
+# each day. Days that are not in the dictionary use the default parameters. Every
+# day has its own copy, so changing one day does not change the others
+cell_area_parameters_per_day = {1: dict(default_cell_area_parameters),
+                                3: dict(default_cell_area_parameters),
+                                5: dict(default_cell_area_parameters)}
+
+
+def rotation_degree_from_corners(corners):
+    '''
+    Calculates the rotation angle in degrees from two points which should be
+    horizontal on the final image. The calculation differs dependent on if the
+    angle is positive or negative.
+    '''
+    if len(corners) != 2:
+        raise UserWarning('Choose to coordiantes on the image to continue')
+    length = np.sqrt((corners[1][0] - corners[0][0])**2 + (corners[1][1] - corners[0][1])**2)
+    if corners[0][1] < corners[1][1]:
+        return 180/np.pi * np.arccos((corners[1][0] - corners[0][0]) / length)
+    return -180/np.pi * np.arccos((corners[1][0] - corners[0][0]) / length)
+
+def rotation_matrix_for_image(rotation_degree, shape):
+    '''
+    Returns the rotation matrix and the (width, height) of the expanded
+    bounding box, so no part of the image is cut away by the rotation.
+    '''
+    # Get the image dimensions (height and width)
+    (h, w) = shape[:2]
+
+    # Calculate the center of the image
+    center = (w / 2, h / 2)
+
+    # Get the rotation matrix
+    rotation_matrix = cv2.getRotationMatrix2D(center, rotation_degree, 1.0)
+
+    # Calculate the new bounding dimensions of the image
+    cos = np.abs(rotation_matrix[0, 0])
+    sin = np.abs(rotation_matrix[0, 1])
+
+    new_width = int((h * sin) + (w * cos))
+    new_height = int((h * cos) + (w * sin))
+
+    # Adjust the rotation matrix to take into account the translation
+    rotation_matrix[0, 2] += (new_width / 2) - center[0]
+    rotation_matrix[1, 2] += (new_height / 2) - center[1]
+
+    return rotation_matrix, (new_width, new_height)
+
+def rotate_with_degree(rotation_degree, image, region=None, interpolation=cv2.INTER_LINEAR):
+    '''
+    Rotates the image by rotation_degree into an expanded bounding box.
+    Returns the rotated image.
+
+    Parameters:
+    region (tuple, optional): (x, y, width, height) of the part of the rotated image
+        that is wanted, e.g. from fields_region. Only this part is calculated, so a
+        small region is much faster than the full image. Coordinates in the result
+        are then relative to (x, y). The region is equivalent to cutting it out of the
+        full rotation up to interpolation rounding (a few pixels can differ by 1).
+    interpolation (int): OpenCV interpolation flag, e.g. cv2.INTER_NEAREST (fastest),
+        cv2.INTER_LINEAR or cv2.INTER_CUBIC.
+    '''
+    return rotate_channels(rotation_degree, [image], region, interpolation)[0]
+
+def rotate_channels(rotation_degree, images, region=None, interpolation=cv2.INTER_LINEAR, workers=1):
+    '''
+    Rotates several channels of the same sample (e.g. BF, UV, Green Ex and Multi Fluo)
+    by the same angle. The rotation matrix is calculated once and used for all channels.
+
+    Parameters:
+    images (list): The images, or one array with the channels along the first axis.
+        All images must have the same height and width.
+    region, interpolation: As in rotate_with_degree.
+    workers (int): With workers above 1 the channels are rotated in that many threads.
+        cv2.warpAffine releases the GIL, so the threads run at the same time.
+
+    Returns:
+    list: The rotated images in the same order.
+    '''
+    sizes = {image.shape[:2] for image in images}
+    if len(sizes) != 1:
+        raise ValueError(f'All channels must have the same size, got {sorted(sizes)}')
+    rotation_matrix, size = rotation_matrix_for_image(rotation_degree, images[0].shape)
+    if region is not None:
+        x, y, width, height = region
+        rotation_matrix[:, 2] -= (x, y)
+        size = (width, height)
+
+    def rotate(image):
+        return cv2.warpAffine(image, rotation_matrix, size, flags=interpolation)
+
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(rotate, images))
+    return [rotate(image) for image in images]
+
+def rotate_with_corners(corners, image, region=None, interpolation=cv2.INTER_LINEAR):
+    '''
+    Rotates the image so the two chosen corners end up on the same x-axis.
+    Returns the rotated image. region and interpolation work as in rotate_with_degree.
+    '''
+    return rotate_with_degree(rotation_degree_from_corners(corners), image, region, interpolation)
+
+def fields_region(all_corners, square_size, size, margin=inter_space_pixels):
+    '''
+    Returns the region (x, y, width, height) covering all fields plus a margin,
+    clipped to an image of the given (width, height). The margin keeps the space
+    around the outer fields, so the fields can still be found automatically in the
+    cropped image.
+    '''
+    corners_array = np.array(all_corners)
+    x0, y0 = np.maximum(corners_array.min(axis=0) - margin, 0)
+    x1, y1 = np.minimum(corners_array.max(axis=0) + square_size + margin, size)
+    return int(x0), int(y0), int(x1 - x0), int(y1 - y0)
+
+def estimate_rotation_degree(BF_image, max_size=2048):
+    '''
+    Estimates the rotation angle in degrees of the fields in an unrotated BF image,
+    so it can be used instead of clicking two corners (the angle has the same sign
+    as the one from rotation_degree_from_corners).
+
+    The edges of the fields run in two directions at a right angle to each other.
+    The direction of the gradient in every pixel is multiplied by four, which makes
+    the two directions the same, and the mean direction weighted by the strength of
+    the edge gives the angle. The result is between -45 and 45 degrees.
+
+    Parameters:
+    BF_image (numpy.ndarray): BGR or grayscale BF image.
+    max_size (int): The image is halved until it is no larger than this, which is
+        plenty for the angle and keeps the estimate fast on large scans.
+    '''
+    gray = BF_image if BF_image.ndim == 2 else cv2.cvtColor(BF_image, cv2.COLOR_BGR2GRAY)
+    while max(gray.shape) > max_size:
+        gray = cv2.pyrDown(gray)
+    # Smoothing and the Scharr kernel keep the gradient directions from being pulled
+    # towards the image axes, which would make the angle too small
+    gray = cv2.GaussianBlur(gray.astype(np.float32), (0, 0), 2)
+
+    gradient_x = cv2.Scharr(gray, cv2.CV_32F, 1, 0)
+    gradient_y = cv2.Scharr(gray, cv2.CV_32F, 0, 1)
+    weight = gradient_x**2 + gradient_y**2
+    direction = 4 * np.arctan2(gradient_y, gradient_x)
+
+    mean_direction = np.arctan2(np.sum(weight * np.sin(direction)), np.sum(weight * np.cos(direction)))
+    return float(np.degrees(mean_direction) / 4)
+
+def corners_from_field_1(felt_1_corner, felt_plus_inter_pixels_x, felt_plus_inter_pixels_y):
+    '''
+    Returns the top left corner of all 64 fields, row by row, from the corner of
+    field 1 and the distance between fields. Raises a ValueError if a corner
+    ends up outside the image.
+    '''
+    all_corners = []
+    for row in range(8):
+        for col in range(8):
+            all_corners.append((felt_1_corner[0] + felt_plus_inter_pixels_x * col, felt_1_corner[1] + felt_plus_inter_pixels_y * row))
+
+    # Checking for negative values
+    for i in all_corners:
+        if i[0] < 0 or i[1] < 1:
+            raise ValueError('Negative coordinates detected, try again with better calibration')
+
+    return all_corners
+
+def calculate_all_corners(corners, valgt_felt, kali_1, kali_2):
+    '''
+    Calculates the top left corner of all 64 fields from the three calibration
+    corners and their field numbers.
+
+    Parameters:
+    corners (list): Three (x, y) corners. The first belongs to valgt_felt and
+        the last two to kali_1 and kali_2.
+    valgt_felt (int): Field number of the first corner.
+    kali_1 (int): Field number of the second corner.
+    kali_2 (int): Field number of the third corner.
+
+    Returns:
+    tuple: (all_corners, felt_plus_inter_pixels_x, felt_plus_inter_pixels_y)
+    '''
+    if len(corners) != 3:
+        raise ValueError('3 corners were not selected, please select 3 corners')
+
+    # Calculation of the x and y length between the corners chosen for calibration
+    # The space between fields is set to 2.5 mm.
+    cols_apart = abs((kali_1 - 8*(math.floor(kali_1/8))) - (kali_2 - 8*(math.floor(kali_2/8))))
+    felt_plus_inter_pixels_x = round(abs(corners[1][0] - corners[2][0]) / cols_apart)
+    rows_apart = abs(math.ceil(kali_1/8) - math.ceil(kali_2/8))
+    felt_plus_inter_pixels_y = round(abs(corners[1][1] - corners[2][1]) / rows_apart)
+
+    # Finding the top left corner of field 1, followed by collection of all top left corners
+    felt_1_corner = tuple(corners[0])
+    # y-coordinate for field 1
+    while valgt_felt - 8 > 0:
+        valgt_felt -= 8
+        felt_1_corner = (felt_1_corner[0], felt_1_corner[1] - felt_plus_inter_pixels_y)
+    # x-coordinate for field 1
+    while valgt_felt - 1 > 0:
+        valgt_felt -= 1
+        felt_1_corner = (felt_1_corner[0] - felt_plus_inter_pixels_x, felt_1_corner[1])
+
+    all_corners = corners_from_field_1(felt_1_corner, felt_plus_inter_pixels_x, felt_plus_inter_pixels_y)
+
+    return all_corners, felt_plus_inter_pixels_x, felt_plus_inter_pixels_y
+
+def calculate_square_size(felt_plus_inter_pixels_x, felt_plus_inter_pixels_y):
+    '''
+    Returns the side length of a field in pixels
+    '''
+    return round((felt_plus_inter_pixels_x + felt_plus_inter_pixels_y) / 2) - inter_space_pixels
+
+def _edge_profile(gray, direction):
+    '''
+    Sum of the absolute difference between neighbouring columns (direction 'x')
+    or rows (direction 'y'). A field starting at position i gives a peak at i.
+    '''
+    if direction == 'x':
+        difference = cv2.absdiff(gray[:, 1:], gray[:, :-1])
+        profile = difference.sum(axis=0, dtype=np.float64)
+    else:
+        difference = cv2.absdiff(gray[1:, :], gray[:-1, :])
+        profile = difference.sum(axis=1, dtype=np.float64)
+    return np.concatenate([[0.0], profile])
+
+def _fit_lattice_1d(profile, search_radius=10):
+    '''
+    Finds the field start positions along one axis of the image.
+
+    The distance between fields is found as the strongest period of the edge
+    profile (autocorrelation through the FFT). A comb with a field start and a
+    field end edge for each of the 8 fields is then slid along the profile to
+    find field 1. Finally the edge closest to each tooth of the comb is located
+    and a straight line is fitted through them.
+
+    Returns:
+    tuple: (start of field 1, distance between fields, residuals of the fit)
+    '''
+    profile = profile - profile.mean()
+    n = len(profile)
+
+    # Autocorrelation through the FFT, zero padded to avoid wrap around
+    spectrum = np.fft.rfft(profile, 2 * n)
+    autocorrelation = np.fft.irfft(spectrum * np.conj(spectrum))[:n]
+    min_pitch = inter_space_pixels + 2 * search_radius
+    max_pitch = n // 8
+    if max_pitch <= min_pitch:
+        raise ValueError('The image is too small to contain 8 fields')
+    pitch = min_pitch + int(np.argmax(autocorrelation[min_pitch:max_pitch]))
+    square_size = pitch - inter_space_pixels
+
+    # Slide a comb with a field start and a field end edge for each of the 8 fields
+    offsets = [k * pitch for k in range(8)] + [k * pitch + square_size for k in range(8)]
+    n_positions = n - offsets[-1]
+    score = np.zeros(n_positions)
+    for offset in offsets:
+        score += profile[offset:offset + n_positions]
+    start = int(np.argmax(score))
+
+    # Locate the edge closest to every field start and fit a straight line through them
+    edges = []
+    for k in range(8):
+        low = max(start + k * pitch - search_radius, 0)
+        high = min(start + k * pitch + search_radius + 1, n)
+        edges.append(low + int(np.argmax(profile[low:high])))
+    fields = np.arange(8)
+    fitted_pitch, fitted_start = np.polyfit(fields, edges, 1)
+    residuals = np.array(edges) - (fitted_start + fitted_pitch * fields)
+
+    return fitted_start, fitted_pitch, residuals
+
+def auto_calibrate_grid(BF_image):
+    '''
+    Finds the 8x8 lattice of fields in a rotated BF image without any clicking.
+
+    Parameters:
+    BF_image (numpy.ndarray): The rotated BF image (BGR or grayscale).
+
+    Returns:
+    tuple: (all_corners, felt_plus_inter_pixels_x, felt_plus_inter_pixels_y, residual)
+        where residual is the root mean square distance in pixels between the
+        found field edges and the fitted lattice. A residual of a few pixels or
+        less means the lattice was found.
+    '''
+    if BF_image.ndim == 3:
+        gray = cv2.cvtColor(BF_image, cv2.COLOR_BGR2GRAY)
+    else:
+        gray = BF_image
+
+    return lattice_from_edge_profiles(_edge_profile(gray, 'x'), _edge_profile(gray, 'y'))
+
+def lattice_from_edge_profiles(profile_x, profile_y):
+    '''
+    The part of auto_calibrate_grid that works on the edge profiles of the BF
+    image. Used directly when the profiles are calculated without loading the
+    full image (see TiledImage.py). Returns the same as auto_calibrate_grid.
+    '''
+    start_x, felt_plus_inter_pixels_x, residuals_x = _fit_lattice_1d(profile_x)
+    start_y, felt_plus_inter_pixels_y, residuals_y = _fit_lattice_1d(profile_y)
+    residual = float(np.sqrt(np.mean(np.concatenate([residuals_x, residuals_y])**2)))
+
+    felt_plus_inter_pixels_x = round(felt_plus_inter_pixels_x)
+    felt_plus_inter_pixels_y = round(felt_plus_inter_pixels_y)
+    felt_1_corner = (round(start_x), round(start_y))
+    all_corners = corners_from_field_1(felt_1_corner, felt_plus_inter_pixels_x, felt_plus_inter_pixels_y)
+
+    return all_corners, felt_plus_inter_pixels_x, felt_plus_inter_pixels_y, residual
+
+def save_calibration(file_path, verbose=True, **values):
+    '''
+    Saves calibration values (corners, field numbers, rotation corners) to a
+    JSON file. Values already in the file are kept unless they are overwritten,
+    so the rotation and the counting script can write to the same file.
+    Values given as None are removed from the file. With verbose it is printed
+    where the calibration was saved.
+    '''
+    calibration = load_calibration(file_path) if os.path.exists(file_path) else {}
+    calibration.update(values)
+    calibration = {key: value for key, value in calibration.items() if value is not None}
+    with open(file_path, 'w') as f:
+        json.dump(calibration, f, indent=4)
+    if verbose:
+        print(f'Calibration saved to {file_path}')
+
+def load_calibration(file_path):
+    '''
+    Loads a calibration file written by save_calibration.
+    Corners are returned as lists of (x, y) tuples.
+    '''
+    with open(file_path) as f:
+        calibration = json.load(f)
+    for key in ['corners', 'rotation_corners']:
+        if key in calibration:
+            calibration[key] = [tuple(c) for c in calibration[key]]
+    return calibration
+
+def read_UV_image(file_path, grayscale=False, channel=None):
+    """
+    Loads a UV image.
+
+    Parameters:
+    file_path (str): Path to the image.
+    grayscale (bool): If True a single channel image is returned, which takes a
+        third of the memory and is counted without the HSV conversion.
+    channel (int, optional): Only with grayscale. Index of the channel to keep
+        (0 is blue, the UV band). Only that channel is kept while the image is
+        read, see read_band in TiledImage.py. If not given the image is read as
+        grayscale.
+
+    Returns:
+    numpy.ndarray or None: The image, or None if it could not be loaded.
+    """
+    if not grayscale:
+        return cv2.imread(file_path)
+    if channel is None:
+        return cv2.imread(file_path, cv2.IMREAD_GRAYSCALE)
+    # Imported here, as TiledImage.py imports from this file
+    from TiledImage import read_band
+    return read_band(file_path, channel)
+
+def _clean_mask(mask):
+    """
+    Morphological clean up of a mask where cells are white.
+    """
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
+    opening = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel, iterations=1)
+    closing = cv2.morphologyEx(opening, cv2.MORPH_CLOSE, kernel, iterations=2)
+    return closing
+
+def cell_mask_hsv(image, hsv_lower, hsv_upper):
+    """
+    Thresholds an image and cleans up the mask.
+    Cells are white and background is black in the returned mask.
+
+    A BGR image is thresholded in HSV color space. A single channel image (see
+    read_UV_image) is thresholded directly: every pixel brighter than the upper
+    V bound (hsv_upper[2]) is a cell. This is the same as the HSV test for gray
+    pixels, but dim coloured pixels that the HSV test calls cells are background.
+    """
+    if image.ndim == 2:
+        # Pixels above the threshold are cells
+        _, mask = cv2.threshold(image, int(hsv_upper[2]), 255, cv2.THRESH_BINARY)
+        return _clean_mask(mask)
+
+    # Convert the image to HSV color space
+    hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+
+    # Create a binary mask using the given HSV range
+    mask = cv2.inRange(hsv, hsv_lower, hsv_upper)
+
+    # Invert the binary mask to ensure cells are white and background is black
+    inverted_mask = cv2.bitwise_not(mask)
+
+    # Apply morphological operations to clean up the mask
+    return _clean_mask(inverted_mask)
+
+def cell_area_parameters(day=None):
+    """
+    Returns the cell area parameters for the given day.
+    """
+    return cell_area_parameters_per_day.get(day, default_cell_area_parameters)
+
+def cells_from_areas(areas, parameters=None):
+    """
+    Number of cells each contour counts as, calculated for all contours at once.
+
+    Parameters:
+    areas (numpy.ndarray): Area of every contour in pixels.
+    parameters (dict, optional): Cell area parameters, see default_cell_area_parameters.
+
+    Returns:
+    numpy.ndarray: Number of cells for every contour.
+    """
+    if parameters is None:
+        parameters = default_cell_area_parameters
+    areas = np.asarray(areas, dtype=np.float64)
+
+    cells = np.where(areas > parameters['connected_cell_area'],
+                     np.floor(areas / parameters['average_cell_area']), 1)
+    cells[(areas <= parameters['minimum_area']) | (areas > parameters['too_large_area'])] = 0
+    return cells.astype(np.int64)
+
+def count_cells_in_square_hsv(square, hsv_lower, hsv_upper, parameters=None):
+    """
+    Count the number of cells in the given square using HSV color space.
+
+    Parameters:
+    square (numpy.ndarray): BGR image of the square region, or a single channel
+        image which is thresholded without the HSV conversion (see cell_mask_hsv).
+    hsv_lower (numpy.ndarray): Lower bound of HSV values for cell detection.
+    hsv_upper (numpy.ndarray): Upper bound of HSV values for cell detection.
+    parameters (dict, optional): Cell area parameters, see default_cell_area_parameters.
+
+    Returns:
+    int: Number of cells detected in the square.
+    """
+    closing = cell_mask_hsv(square, hsv_lower, hsv_upper)
+
+    # Find contours in the binary mask
+    contours, _ = cv2.findContours(closing, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    # Count the number of cells based on contour areas
+    areas = np.array([cv2.contourArea(contour) for contour in contours])
+    return int(cells_from_areas(areas, parameters).sum())
+
+def count_cells_in_fields(UV_image, all_corners, square_size, hsv_lower=hsv_lower, hsv_upper=hsv_upper,
+                          parameters=None):
+    '''
+    Counts the cells in every field. Returns a dictionary with the top left
+    corner of each field as key and the cell count as value.
+    '''
+    cell_counts = {}
+    for (x, y) in all_corners:
+        # Extract the square from the image, y og x er benbart sådan her
+        square = UV_image[y:y+square_size, x:x+square_size]
+        cell_counts[(x, y)] = count_cells_in_square_hsv(square, hsv_lower, hsv_upper, parameters)
+    return cell_counts
+
+def count_cells_single_pass(UV_image, all_corners, square_size, hsv_lower=hsv_lower, hsv_upper=hsv_upper,
+                            parameters=None):
+    '''
+    Counts the cells in every field by segmenting the whole UV image once.
+
+    The image is thresholded and cleaned once, all contours are found in one go
+    and every contour is given to the field its centroid lies in. Contours with
+    their centroid between fields are not counted. Cells lying fully inside a
+    field get exactly the same count as with count_cells_in_fields, while cells
+    cut by the field border are counted once, in the field holding their centre.
+
+    Returns:
+    dict: The top left corner of each field as key and the cell count as value.
+    '''
+    # Only the area covered by the fields (plus a small margin, so the morphology
+    # at the field borders is the same as on the full image) is segmented
+    corners_array = np.array(all_corners)
+    margin = 8
+    x0, y0 = np.maximum(corners_array.min(axis=0) - margin, 0)
+    x1, y1 = corners_array.max(axis=0) + square_size + margin
+    region = UV_image[y0:y1, x0:x1]
+
+    closing = cell_mask_hsv(region, hsv_lower, hsv_upper)
+    contours, _ = cv2.findContours(closing, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE, offset=(int(x0), int(y0)))
+
+    # Area and centroid of every contour. The area of the moments is the same as
+    # cv2.contourArea, so the area rule gives the same result as per field.
+    # Degenerate contours keep an area of 0 and are never counted.
+    areas = np.zeros(len(contours))
+    centroids = np.full((len(contours), 2), -1.0)
+    for i, contour in enumerate(contours):
+        moments = cv2.moments(contour)
+        if moments['m00'] > 0:
+            areas[i] = moments['m00']
+            centroids[i] = (moments['m10'] / moments['m00'], moments['m01'] / moments['m00'])
+
+    # Field of every contour
+    inside = ((centroids[:, None, 0] >= corners_array[None, :, 0]) &
+              (centroids[:, None, 0] < corners_array[None, :, 0] + square_size) &
+              (centroids[:, None, 1] >= corners_array[None, :, 1]) &
+              (centroids[:, None, 1] < corners_array[None, :, 1] + square_size))
+
+    counts = cells_from_areas(areas, parameters) @ inside
+    return {(x, y): int(count) for (x, y), count in zip(all_corners, counts)}
+
+def warp_field_windows(image, rotation_matrix, all_corners, square_size):
+    '''
+    Returns the fields of the rotated image without rotating the full image.
+
+    The rotation matrix is moved to the top left corner of each field, so
+    cv2.warpAffine only calculates the pixels of that field. Every field is
+    equivalent to cutting it out of cv2.warpAffine(image, rotation_matrix, size) up
+    to interpolation rounding: the moved translation changes the fixed-point
+    rounding of warpAffine, so a few pixels can differ by 1.
+
+    Returns:
+    dict: The top left corner of each field (in the rotated image) as key and the field as value.
+    '''
+    fields = {}
+    for (x, y) in all_corners:
+        field_matrix = rotation_matrix.copy()
+        field_matrix[:, 2] -= (x, y)
+        fields[(x, y)] = cv2.warpAffine(image, field_matrix, (square_size, square_size))
+    return fields
+
+def count_cells_in_rotated_fields(UV_image, rotation_matrix, all_corners, square_size, hsv_lower=hsv_lower,
+                                  hsv_upper=hsv_upper, parameters=None):
+    '''
+    Same as count_cells_in_fields, but for an unrotated UV image. Only the fields
+    are rotated (see warp_field_windows), so the rotated UV image is never made.
+    The fields are equivalent to the saved rotated image up to interpolation
+    rounding, so a cell right at the threshold can now and then change the count of
+    a field by one, see compare_fused_with_rotated in BatchAnalyseAfPitsCellebilleder.py.
+    '''
+    cell_counts = {}
+    for (x, y), square in warp_field_windows(UV_image, rotation_matrix, all_corners, square_size).items():
+        cell_counts[(x, y)] = count_cells_in_square_hsv(square, hsv_lower, hsv_upper, parameters)
+    return cell_counts
+
+def change_orientation(orientation, cell_counts):
+    '''
+    Takes the list of fields and the cell counts corresponding to the fields,
+    and changes the number of the fields to properly match dependent on the
+    orientation of the master used.
+    '''
+    output = {}
+    i = 1
+
+    if orientation == 'N':
+        for coords in cell_counts:
+            output[i] = (cell_counts.get(coords), coords)
+            i += 1
+        return output
+
+    if orientation == 'W':
+        for coords in cell_counts:
+            output[i] = (cell_counts.get(coords), coords)
+            if i < 57:
+                i += 8
+            else:
+                i -= 55
+        return output
+
+    if orientation == 'E':
+        i = 64
+        for coords in cell_counts:
+            output[i] = (cell_counts.get(coords), coords)
+            if i < 9:
+                i += 55
+            else:
+                i -= 8
+        return output
+
+    if orientation == 'S':
+        i = 57
+        for coords in cell_counts:
+            output[i] = (cell_counts.get(coords), coords)
+            if i//8 == i/8:
+                i -= 15
+            else:
+                i += 1
+        return output
+
+def write_cell_count_workbook(template_path, new_file_path, sample_name, cell_count_matching, felter_der_beholdes=range(1, 65)):
+    '''
+    Writes the cell counts into a copy of the Excel template.
+    The sample name goes into A1 and the counts for the kept fields into B2 to B65.
+    '''
+    # Load the existing Excel file and select the active sheet
+    wb = openpyxl.load_workbook(template_path)
+    ws = wb.active
+
+    # Inserts the name of the sample in the top of the file
+    ws['A1'] = sample_name
+
+    # Write cell counts to cells B2 to B65
+    for i in felter_der_beholdes:
+        # Get cell count for field number (or 0 if not found)
+        ws[f'B{i+1}'] = cell_count_matching.get(i, (0,))[0]
+
+    wb.save(new_file_path)
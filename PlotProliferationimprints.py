@@ -2,20 +2,43 @@ import os
 import pandas as pd
 import matplotlib.pyplot as plt
 
-def calculate_separate_y_limits(source_folder, days, selected_samples=None):
+from ExcelLoader import read_excel_files
+
+# Area of a field in mm^2. The counts are divided by it to give cells per mm^2
+field_area = 4.41
+
+def sample_statistics(df, field_area=field_area):
     """
-    Calculate separate y-axis limits for each day across all relevant Excel files.
+    Calculate the mean and standard deviation of every sample (row) at once.
+
+    Parameters:
+        df (pd.DataFrame): Table with the sample names in the first column and the counts in the other columns.
+        field_area (float): The counts are divided by this before the statistics are calculated.
+
+    Returns:
+        pd.DataFrame: The columns 'Sample', 'mean', 'std', 'lower' (mean - std) and 'upper' (mean + std), one row per sample.
+    """
+    counts = df.iloc[:, 1:].astype(float) / field_area
+    stats = pd.DataFrame({'Sample': df.iloc[:, 0], 'mean': counts.mean(axis=1), 'std': counts.std(axis=1)})
+    stats['lower'] = stats['mean'] - stats['std']
+    stats['upper'] = stats['mean'] + stats['std']
+    return stats
+
+def load_statistics(source_folder, days, selected_samples=None, field_area=field_area, workers=None):
+    """
+    Read every combined Excel file of the chosen days once and calculate its sample statistics.
 
     Parameters:
         source_folder (str): Path to the folder containing Excel files.
         days (list of int): List of day values to filter the files.
         selected_samples (list of str, optional): List of sample names to include. Defaults to None.
+        field_area (float): See sample_statistics.
+        workers (int, optional): Number of processes reading the files, see read_excel_files in ExcelLoader.py.
 
     Returns:
-        dict: A dictionary with day as keys and (min, max) tuples as values for y-axis limits per day.
+        list of tuple: (file_name, day, statistics from sample_statistics) for every file.
     """
-    y_limits = {day: (float('inf'), float('-inf')) for day in days}
-
+    files = []
     for file_name in os.listdir(source_folder):
         if file_name.endswith('.xlsx') and 'combined' in file_name:  # Check if 'combined' is in the filename
             try:
@@ -25,25 +48,50 @@ def calculate_separate_y_limits(source_folder, days, selected_samples=None):
                 continue
 
             if day in days:
-                file_path = os.path.join(source_folder, file_name)
-                df = pd.read_excel(file_path)
-
-                # Filter rows based on selected samples, if provided
-                if selected_samples:
-                    df = filter_samples(df, selected_samples)
-
-                if not df.empty:
-                    # Calculate the min and max including the error bars for the specific day
-                    for _, row in df.iterrows():
-                        mean_value = row[1:].mean() / 4
-                        std_dev = row[1:].std() / 4
-                        y_min = mean_value - std_dev
-                        y_max = mean_value + std_dev
-                        current_min, current_max = y_limits[day]
-                        y_limits[day] = (min(current_min, y_min), max(current_max, y_max))
+                files.append((file_name, day))
+
+    frames = read_excel_files([os.path.join(source_folder, file_name) for file_name, _ in files], workers)
+    statistics = []
+    for (file_name, day), df in zip(files, frames):
+        # Filter rows based on selected samples, if provided
+        if selected_samples:
+            df = filter_samples(df, selected_samples)
+        statistics.append((file_name, day, sample_statistics(df, field_area)))
+    return statistics
+
+def separate_y_limits(statistics, days):
+    """
+    Calculate separate y-axis limits for each day, including the error bars.
 
+    Parameters:
+        statistics (list of tuple): The files from load_statistics.
+        days (list of int): List of day values.
+
+    Returns:
+        dict: A dictionary with day as keys and (min, max) tuples as values for y-axis limits per day.
+    """
+    y_limits = {day: (float('inf'), float('-inf')) for day in days}
+    for _, day, stats in statistics:
+        if not stats.empty:
+            current_min, current_max = y_limits[day]
+            y_limits[day] = (min(current_min, stats['lower'].min()), max(current_max, stats['upper'].max()))
     return y_limits
 
+def calculate_separate_y_limits(source_folder, days, selected_samples=None, field_area=field_area):
+    """
+    Calculate separate y-axis limits for each day across all relevant Excel files.
+
+    Parameters:
+        source_folder (str): Path to the folder containing Excel files.
+        days (list of int): List of day values to filter the files.
+        selected_samples (list of str, optional): List of sample names to include. Defaults to None.
+        field_area (float): See sample_statistics.
+
+    Returns:
+        dict: A dictionary with day as keys and (min, max) tuples as values for y-axis limits per day.
+    """
+    return separate_y_limits(load_statistics(source_folder, days, selected_samples, field_area), days)
+
 def extract_day_from_filename(file_name):
     """
     Extract the day number from the filename.
@@ -82,7 +130,7 @@ def filter_samples(df, selected_samples):
         print("No matching samples found after filtering.")
     return filtered_df
 
-def plot_excel_files(source_folder, days, selected_samples=None):
+def plot_excel_files(source_folder, days, selected_samples=None, field_area=field_area, workers=None):
     """
     Process Excel files and generate plots for specified days and samples.
 
@@ -90,39 +138,27 @@ def plot_excel_files(source_folder, days, selected_samples=None):
         source_folder (str): Path to the folder containing Excel files.
         days (list of int): List of day values to filter files.
         selected_samples (list of str, optional): List of sample names to include. Defaults to None.
+        field_area (float): All cell count values are divided by this, see sample_statistics.
+        workers (int, optional): Number of processes reading the files, see read_excel_files in ExcelLoader.py.
     """
-    # Calculate separate y-axis limits for each day
-    day_y_limits = calculate_separate_y_limits(source_folder, days, selected_samples)
+    # The statistics are calculated once and used for both the y-axis limits and the plots
+    statistics = load_statistics(source_folder, days, selected_samples, field_area, workers)
 
-    for file_name in os.listdir(source_folder):
-        if file_name.endswith('.xlsx') and 'combined' in file_name:  # Only process files with 'combined' in the name
-            try:
-                day = extract_day_from_filename(file_name)
-            except ValueError:
-                print(f"Skipping file due to naming issues: {file_name}")
-                continue
-
-            if day in days:
-                file_path = os.path.join(source_folder, file_name)
-                print(f"Processing file: {file_path}")
-                df = pd.read_excel(file_path)
-
-                # Divide all cell count values by 4.41 before plotting
-                df.iloc[:, 1:] = df.iloc[:, 1:].astype(float) / 4.41
-
-                if selected_samples:
-                    df = filter_samples(df, selected_samples)
+    # Calculate separate y-axis limits for each day
+    day_y_limits = separate_y_limits(statistics, days)
 
-                if not df.empty:
-                    # Use the y-limits specific to the day
-                    plot_data(df, day, day_y_limits[day])
+    for file_name, day, stats in statistics:
+        print(f"Processing file: {os.path.join(source_folder, file_name)}")
+        if not stats.empty:
+            # Use the y-limits specific to the day
+            plot_data(stats, day, day_y_limits[day])
 
-def plot_data(df, day, y_limits):
+def plot_data(stats, day, y_limits):
     """
     Plot the data for a specific day with special handling for 'C', 'E1', and 'E2'.
 
     Parameters:
-        df (pd.DataFrame): The DataFrame containing the data to plot.
+        stats (pd.DataFrame): The sample statistics from sample_statistics.
         day (int): The day corresponding to the current data.
         y_limits (tuple): The y-axis limits for the plot.
     """
@@ -137,20 +173,17 @@ def plot_data(df, day, y_limits):
     x_positions = []
 
     # Separate the special cases
-    c_rows = df[df['Sample'] == 'C']
-    e1_rows = df[df['Sample'].str.contains('E1')]
-    e2_rows = df[df['Sample'].str.contains('E2')]
+    c_rows = stats[stats['Sample'] == 'C']
+    e1_rows = stats[stats['Sample'].str.contains('E1')]
+    e2_rows = stats[stats['Sample'].str.contains('E2')]
     
     # Plot 'C', 'E1', and 'E2' rows with error bars
     # Similar to how you previously handled 'C', 'E1', and 'E2'
     # (code goes here)
 
     # Plot all other samples
-    other_samples = df[~df['Sample'].str.contains('C|E1|E2')]
-    for i, row in other_samples.iterrows():
-        sample = row['Sample']
-        mean_value = row[1:].mean()
-        std_dev = row[1:].std()
+    other_samples = stats[~stats['Sample'].str.contains('C|E1|E2')]
+    for sample, mean_value, std_dev in zip(other_samples['Sample'], other_samples['mean'], other_samples['std']):
         x_positions.append(len(x_positions))  # Position for each sample
         sample_labels.append(sample)
         plt.errorbar(x_positions[-1], mean_value, yerr=std_dev, fmt='o', capsize=10, lw=line_width, markersize=marker_size)
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+'''
+Results store for the cell counts, used instead of a CellCountData.xlsx file per
+sample.
+
+The counts of all samples are saved as rows in one SQLite database (a single
+file, no server is needed), with one row per field:
+
+    sample, sample_folder, day, master, orientation, field, count, x, y,
+    parameters, calibration, counted_at
+
+parameters holds the cell area parameters and calibration the calibration of the
+sample (both as JSON), so it can be seen later how every count was made. Counting
+a sample again replaces its rows.
+
+The Excel files are only made at the end with export_report, which writes the
+counts of every day into one workbook in the layout "Collect Results.py" makes
+(the labels of the template in the column 'Sample' and a column per sample), so
+the plotting scripts can read it.
+'''
+
+import json
+import os
+import sqlite3
+from datetime import datetime
+
+import pandas as pd
+
+# File name of the results store, saved in the same folder as CellCountDataSkabelon.xlsx
+results_store_name = 'CellCountData.sqlite'
+
+# The Excel template the field labels of the report are taken from
+template_name = 'CellCountDataSkabelon.xlsx'
+
+_create_table = '''
+CREATE TABLE IF NOT EXISTS cell_counts (
+    sample TEXT NOT NULL,
+    sample_folder TEXT NOT NULL,
+    day INTEGER,
+    master TEXT,
+    orientation TEXT,
+    field INTEGER NOT NULL,
+    count INTEGER,
+    x INTEGER,
+    y INTEGER,
+    parameters TEXT,
+    calibration TEXT,
+    counted_at TEXT,
+    PRIMARY KEY (sample_folder, field)
+)'''
+
+
+def open_store(store_path):
+    '''
+    Opens the results store and creates it if it does not exist. Several processes
+    can write to the store at the same time, a process waits up to a minute for the
+    others to finish writing.
+    '''
+    connection = sqlite3.connect(store_path, timeout=60)
+    connection.execute(_create_table)
+    return connection
+
+def sample_rows(sample_name, sample_folder, cell_count_matching, day=None, master=None, orientation=None,
+                parameters=None, calibration=None, felter_der_beholdes=range(1, 65)):
+    '''
+    The rows of a sample in the results store, one for every kept field.
+
+    Parameters:
+    cell_count_matching (dict): Field number: (count, (x, y)) from change_orientation.
+    felter_der_beholdes (iterable): The field numbers that are saved, fields without
+        a count get 0 like in the Excel file.
+    '''
+    counted_at = datetime.now().isoformat(timespec='seconds')
+    parameters = json.dumps(parameters) if parameters is not None else None
+    calibration = json.dumps(calibration) if calibration is not None else None
+
+    rows = []
+    for field in sorted(felter_der_beholdes):
+        count, coords = cell_count_matching.get(field, (0, (None, None)))
+        rows.append((sample_name, sample_folder, day, master, orientation, field, int(count or 0),
+                     coords[0], coords[1], parameters, calibration, counted_at))
+    return rows
+
+def save_sample(store_path, rows):
+    '''
+    Saves the rows of a sample from sample_rows in the results store. Rows already
+    saved for the sample folder are replaced in the same transaction, so the store
+    never holds half a sample.
+    '''
+    connection = open_store(store_path)
+    try:
+        with connection:
+            for sample_folder in {row[1] for row in rows}:
+                connection.execute('DELETE FROM cell_counts WHERE sample_folder = ?', (sample_folder,))
+            connection.executemany('INSERT INTO cell_counts VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+    finally:
+        connection.close()
+    return store_path
+
+def load_results(store_path, days=None):
+    '''
+    Reads the results store as a DataFrame with a row per field, optionally only
+    the given days.
+    '''
+    connection = open_store(store_path)
+    try:
+        query = 'SELECT * FROM cell_counts'
+        values = []
+        if days is not None:
+            days = list(days)
+            query += f' WHERE day IN ({", ".join("?" * len(days))})'
+            values = days
+        return pd.read_sql_query(query + ' ORDER BY day, sample, field', connection, params=values)
+    finally:
+        connection.close()
+
+def template_labels(template_path):
+    '''
+    The labels in the first column of the Excel template ('C', 'E1', '1;2 (HEX)' ...)
+    with the field number as key. Field i is in row i + 1, below the sample name in A1.
+    '''
+    template = pd.read_excel(template_path, header=None)
+    if template.shape[1] == 0:
+        return {}
+    return {field: label for field, label in template.iloc[1:, 0].items() if pd.notna(label)}
+
+def export_report(store_path, report_path, days=None, template_path=None):
+    '''
+    Writes the counts of the results store to one Excel file with a sheet per day
+    ('Dag 1', 'Dag 3' ...). Every sheet has the labels of the template (see
+    template_labels) in the column 'Sample', like the CellCountData files, and a
+    column with the counts of every sample. A field without a label in the template
+    keeps its number. Samples without a day are put in the sheet 'Uden dag'.
+
+    The columns are named after the sample folders. Samples of a day with the same
+    name in different experiments get the whole sample folder as name.
+
+    Parameters:
+    template_path (str, optional): The Excel template. CellCountDataSkabelon.xlsx in
+        the folder of the results store if it is not given.
+
+    Returns:
+    str: report_path, or None if the results store has no counts.
+    '''
+    results = load_results(store_path, days)
+    if results.empty:
+        print(f'No counts in {store_path}, no report was made')
+        return None
+
+    if template_path is None:
+        template_path = os.path.join(os.path.dirname(store_path), template_name)
+    labels = template_labels(template_path) if os.path.exists(template_path) else {}
+
+    with pd.ExcelWriter(report_path) as writer:
+        for day, day_results in results.groupby(results['day'].fillna(-1), sort=True):
+            # The store is keyed on the sample folder, the name is only used where it is unique
+            shared_name = day_results.groupby('sample')['sample_folder'].transform('nunique') > 1
+            column_names = day_results['sample'].mask(shared_name, day_results['sample_folder'])
+            table = day_results.assign(sample=column_names).pivot(index='field', columns='sample', values='count')
+            table.insert(0, 'Sample', [labels.get(field, field) for field in table.index])
+            table = table.rename_axis(None, axis=1).reset_index(drop=True)
+            sheet_name = 'Uden dag' if day == -1 else f'Dag {int(day)}'
+            table.to_excel(writer, sheet_name=sheet_name, index=False)
+    print(f'Report saved to {report_path}')
+    return report_path
+
+# Example usage
+if __name__ == "__main__":
+    # The same path as in AnalyseAfPitsCellebilleder.py
+    path = 'C:/Users/User/Desktop/Andreas script - Data folder/Andreas script - Data folder/'
+    store_path = os.path.join(path, results_store_name)
+
+    export_report(store_path, os.path.join(path, 'CellCountData rapport.xlsx'))
@@ -10,102 +10,42 @@ This needs to be done manually:
 
 '''
 
-import numpy as np
+import os
+
 import cv2
 
+from PitsCellebilleder import (calibration_file_name, rotation_degree_from_corners, rotate_channels, save_calibration,
+                               load_calibration)
+from ImageViewer import ImageViewer
+from TiledImage import write_image
+
 # Collection of corners for rotation
 corners = []
-# x and y values one is currently at on images
-current_x, current_y = 0, 0
 
 # Functions
-def save_image_coordinates(event, x, y, flags, param):
-    """
-    Mouse callback function to get coordinates relative to the full image.
-    """
-    if event == cv2.EVENT_LBUTTONDOWN:
-        if len(corners) < 2:
-            # Calculate the coordinates relative to the full image
-            zoom_factor = zoom_level / 100.0
-            full_x = int(current_x + x / zoom_factor)
-            full_y = int(current_y + y / zoom_factor)
-            corners.append((full_x, full_y))
-            print(f"Saved coordinates ({full_x}, {full_y})")
-
-
-def rotate_image(corners, image, img_name):
+def rotate_image(corners, images, img_names, region=None, interpolation=cv2.INTER_LINEAR, workers=2,
+                 pyramid=False, compression='deflate'):
+    '''
+    Rotates one image, or a list of images of the same sample which all get the same
+    rotation. The rotation matrix is only calculated once and the images are rotated
+    in workers threads. pyramid and compression are passed on to write_image.
+    '''
     global path, img_path
-    # The angle needed for rotaiton is calculated from two coordinates, the
-    # calculation differs dependent on if the angle is positive or negative
-    if len(corners) != 2:
-        raise UserWarning('Choose to coordiantes on the image to continue')
-    if corners[0][1] < corners[1][1]:
-        rotation_degree = 180/np.pi * np.arccos((corners[1][0] - corners[0][0]) / np.sqrt((corners[1][0] - corners[0][0])**2 + (corners[1][1] - corners[0][1])**2))
-    else:
-        rotation_degree = -180/np.pi * np.arccos((corners[1][0] - corners[0][0]) / np.sqrt((corners[1][0] - corners[0][0])**2 + (corners[1][1] - corners[0][1])**2))
-
-    # Get the image dimensions (height and width)
-    (h, w) = image.shape[:2]
-    
-    # Calculate the center of the image
-    center = (w / 2, h / 2)
-    
-    # Get the rotation matrix
-    rotation_matrix = cv2.getRotationMatrix2D(center, rotation_degree, 1.0)
-    
-    # Calculate the new bounding dimensions of the image
-    cos = np.abs(rotation_matrix[0, 0])
-    sin = np.abs(rotation_matrix[0, 1])
-    
-    new_width = int((h * sin) + (w * cos))
-    new_height = int((h * cos) + (w * sin))
-    
-    # Adjust the rotation matrix to take into account the translation
-    rotation_matrix[0, 2] += (new_width / 2) - center[0]
-    rotation_matrix[1, 2] += (new_height / 2) - center[1]
-    
-    # Perform the rotation
-    rotated_image = cv2.warpAffine(image, rotation_matrix, (new_width, new_height))
-    
-    # Save the rotated image
-    output_path = path + sample_folder + img_name
-    cv2.imwrite(output_path, rotated_image)
-    
-    print()
-    print(f"Rotated image saved as {output_path}")
-
-def update_image(x, y, zoom, image, window_size):
-    """
-    Update the displayed image based on the trackbar positions and zoom level.
-    """
-    global current_x, current_y, zoom_level
-    current_x, current_y = x, y
-    zoom_level = zoom
-    
-    h, w = image.shape[:2]
+    if isinstance(img_names, str):
+        images, img_names = [images], [img_names]
+
+    # The angle needed for rotaiton is calculated from two coordinates and the
+    # images are rotated into an expanded bounding box, or only into region if it is given
+    rotation_degree = rotation_degree_from_corners(corners)
+    rotated_images = rotate_channels(rotation_degree, images, region, interpolation, workers)
     
-    # Calculate the size of the displayed area based on zoom level
-    zoom_factor = zoom / 100.0
-    display_w = int(window_size / zoom_factor)
-    display_h = int(window_size / zoom_factor)
-
-    # Ensure the displayed area does not exceed the image dimensions
-    x_end = min(x + display_w, w)
-    y_end = min(y + display_h, h)
-    cropped_image = image[y:y_end, x:x_end]
-
-    # Resize the cropped image to fit the window size
-    resized_image = cv2.resize(cropped_image, (window_size, window_size))
-    cv2.imshow('Image Viewer', resized_image)
-
-def on_trackbar(val, image, window_size):
-    """
-    Callback function for trackbar.
-    """
-    x = cv2.getTrackbarPos('X', 'Image Viewer')
-    y = cv2.getTrackbarPos('Y', 'Image Viewer')
-    zoom = cv2.getTrackbarPos('Zoom', 'Image Viewer')
-    update_image(x, y, zoom, image, window_size)
+    # Save the rotated images
+    for img_name, rotated_image in zip(img_names, rotated_images):
+        output_path = path + sample_folder + img_name
+        write_image(output_path, rotated_image, pyramid, compression)
+        
+        print()
+        print(f"Rotated image saved as {output_path}")
 
 
 # Execution
@@ -134,22 +74,20 @@ else:
 # the screen size correctly, but it should not affect the resulting image
 window_size = 500
 
-# Image is shown, 'select_corners' is called so one can choose two corners that
-# should be on the same x-axis. Choose corners far from each other for best results
-cv2.imshow('Image Viewer', MFimage[:window_size, :window_size])
-cv2.setMouseCallback('Image Viewer', save_image_coordinates)
+# Set region to (x, y, width, height) to only calculate and save that part of the rotated
+# images, e.g. the area around the fields. Leave it as None to keep the full rotated image.
+# The interpolation can be cv2.INTER_NEAREST (fastest), cv2.INTER_LINEAR or cv2.INTER_CUBIC
+region = None
+interpolation = cv2.INTER_LINEAR
 
-# Trackbars are generated making it possible to change X, Y and Zoom
-cv2.createTrackbar('X', 'Image Viewer', 0, max(0, MFimage.shape[1] - window_size), lambda val: on_trackbar(val, MFimage, window_size))
-cv2.createTrackbar('Y', 'Image Viewer', 0, max(0, MFimage.shape[0] - window_size), lambda val: on_trackbar(val, MFimage, window_size))
-cv2.createTrackbar('Zoom', 'Image Viewer', 100, 500, lambda val: on_trackbar(val, MFimage, window_size))  # Zoom range from 100% to 500%
-cv2.waitKey(0)
-cv2.destroyAllWindows()
+# Set pyramid to True to save the rotated images as tiled pyramid TIFF files, which are
+# faster to view and crop. The compression can be 'none', 'deflate', 'lzw' or 'jpeg'
+pyramid = False
+compression = 'deflate'
 
-# The function which can rotate images is called on the Multi Fluo image
-rotate_image(corners, MFimage, 'Zbehandlet - Rotated BF image.tif')
-
-print('Rotation of BF image was successful')
+# Image is shown, 'select_corners' is called so one can choose two corners that
+# should be on the same x-axis. Choose corners far from each other for best results
+ImageViewer(MFimage, 'Image Viewer', window_size, clicks=corners, max_clicks=2).show()
 
 # UV is treated. Image is loaded
 # Name of UV image
@@ -161,9 +99,19 @@ if UVimage is None:
     print("Error loading image")
     exit(1)
 
-# The function which can rotate images is called on the UV image
-# The coordinates which are already chosen are reused, making sure that the
-# multi fluo and UV image get the same rotation
-rotate_image(corners, UVimage, 'Zbehandlet - Rotated UV image.tif')
-
-print('Rotation of UV image was successful')
+# The function which can rotate images is called on the Multi Fluo and the UV image
+# together. The coordinates which are chosen are used for both, making sure that the
+# multi fluo and UV image get the same rotation. More channels can be added to the lists
+rotate_image(corners, [MFimage, UVimage], ['Zbehandlet - Rotated BF image.tif', 'Zbehandlet - Rotated UV image.tif'],
+             region, interpolation, pyramid=pyramid, compression=compression)
+
+print('Rotation of BF and UV image was successful')
+
+# The corners are saved in the sample folder so the rotation can be repeated by
+# BatchAnalyseAfPitsCellebilleder.py without clicking again. A region saved by an
+# earlier rotation is removed if the new images are not cropped, and field corners
+# clicked on the earlier rotated images no longer fit and are removed as well
+calibration_path = path + sample_folder + calibration_file_name
+if os.path.exists(calibration_path) and 'corners' in load_calibration(calibration_path):
+    print('The saved field corners are removed, they have to be clicked again on the new rotated images')
+save_calibration(calibration_path, rotation_corners=corners, rotation_region=region, corners=None)
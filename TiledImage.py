@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+'''
+Reads only parts of large images, so a sample can be counted without loading the
+full BF and UV images into memory.
+
+The images are opened with pyvips, which decodes only the strips or tiles of the
+TIFF file that are needed for the requested region. Regions are returned as BGR
+numpy arrays, the same as cv2.imread, so they can be given directly to the
+functions in PitsCellebilleder.py.
+
+Images written with write_image(..., pyramid=True) are tiled TIFF files holding the
+image at full, half, quarter ... resolution, so a region or a smaller resolution
+(see open_tiled) can be read without decoding the full image. cv2.imread still
+reads them as the full image.
+'''
+
+import os
+
+import numpy as np
+import cv2
+import pyvips
+
+from PitsCellebilleder import count_cells_in_square_hsv, hsv_lower, hsv_upper
+
+# numpy data type for every pyvips band format used by the microscope images
+_numpy_dtypes = {'uchar': np.uint8, 'char': np.int8, 'ushort': np.uint16, 'short': np.int16,
+                 'uint': np.uint32, 'int': np.int32, 'float': np.float32, 'double': np.float64}
+
+
+# OME-XML written into OME-TIFF files, see write_image
+_ome_xml = '''<?xml version="1.0" encoding="UTF-8"?>
+<OME xmlns="http://www.openmicroscopy.org/Schemas/OME/2016-06">
+    <Image ID="Image:0" Name="{name}">
+        <Pixels ID="Pixels:0" DimensionOrder="XYCZT" Type="{type}" Interleaved="true"
+                SizeX="{width}" SizeY="{height}" SizeC="{bands}" SizeZ="1" SizeT="1">
+            <Channel ID="Channel:0:0" SamplesPerPixel="{bands}"/>
+            <TiffData/>
+        </Pixels>
+    </Image>
+</OME>'''
+
+# OME pixel type for every pyvips band format used by the microscope images
+_ome_types = {'uchar': 'uint8', 'char': 'int8', 'ushort': 'uint16', 'short': 'int16',
+              'uint': 'uint32', 'int': 'int32', 'float': 'float', 'double': 'double'}
+
+
+def open_tiled(file_path, level=0):
+    '''
+    Opens an image for region access. Nothing is decoded before a region is read.
+    level chooses the resolution of a pyramid TIFF written by write_image, where
+    every level has half the width and height of the one before.
+    '''
+    if level == 0:
+        return pyvips.Image.new_from_file(file_path, access='random')
+    image = pyvips.Image.new_from_file(file_path)
+    if 'n-subifds' in image.get_fields():
+        # OME-TIFF keeps the smaller levels as sub-images of the full image
+        return pyvips.Image.new_from_file(file_path, subifd=level - 1, access='random')
+    return pyvips.Image.new_from_file(file_path, page=level, access='random')
+
+def to_numpy(image):
+    '''
+    Converts a (small) pyvips image to a numpy array with the shape (height, width, bands).
+    '''
+    return np.ndarray(buffer=image.write_to_memory(), dtype=_numpy_dtypes[image.format],
+                      shape=[image.height, image.width, image.bands])
+
+def from_numpy(image):
+    '''
+    Converts a BGR (or single channel) numpy array from cv2.imread to an RGB pyvips image.
+    '''
+    if image.ndim == 3 and image.shape[2] == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    return pyvips.Image.new_from_array(image)
+
+def write_image(output_path, image, pyramid=False, compression='deflate', tile_size=256, ome=False):
+    '''
+    Saves an image. Without pyramid it is the same as cv2.imwrite.
+
+    Parameters:
+    output_path (str): Path of the image, a .tif file if pyramid is True.
+    image (numpy.ndarray or pyvips.Image): BGR image like from cv2.imread, or a pyvips image.
+    pyramid (bool): Save a tiled TIFF with the image at full, half, quarter ... resolution.
+    compression (str): TIFF compression, e.g. 'none', 'deflate', 'lzw', 'zstd' or
+        'jpeg' (smallest, but not lossless).
+    tile_size (int): Width and height of the tiles.
+    ome (bool): Save as OME-TIFF, which microscopy software like QuPath and Fiji
+        reads with its size and channels.
+    '''
+    if not pyramid:
+        if isinstance(image, pyvips.Image):
+            image.write_to_file(output_path)
+        else:
+            cv2.imwrite(output_path, image)
+        return
+
+    if not isinstance(image, pyvips.Image):
+        image = from_numpy(image)
+    if ome:
+        image = image.copy()
+        image.set_type(pyvips.GValue.gstr_type, 'image-description',
+                       _ome_xml.format(name=os.path.basename(output_path), type=_ome_types[image.format],
+                                       width=image.width, height=image.height, bands=image.bands))
+    image.tiffsave(output_path, tile=True, tile_width=tile_size, tile_height=tile_size, pyramid=True,
+                   subifd=ome, compression=compression)
+
+def read_region(image, x, y, width, height):
+    '''
+    Reads a region of an image opened with open_tiled. The region is clipped to the
+    image like numpy slicing, so the result can be smaller than width x height.
+
+    Returns:
+    numpy.ndarray: The region in BGR (or as a single channel for one band images).
+    '''
+    x_end = min(x + width, image.width)
+    y_end = min(y + height, image.height)
+    x, y = max(x, 0), max(y, 0)
+    if x_end <= x or y_end <= y:
+        return np.zeros((0, 0, image.bands), dtype=_numpy_dtypes[image.format])
+
+    region = to_numpy(image.crop(x, y, x_end - x, y_end - y))
+    if image.bands == 1:
+        return region[:, :, 0]
+    if image.bands == 3:
+        return cv2.cvtColor(region, cv2.COLOR_RGB2BGR)
+    if image.bands == 4:
+        return cv2.cvtColor(region, cv2.COLOR_RGBA2BGR)
+    return region
+
+def read_band(file_path, channel):
+    '''
+    Reads a single channel of an image, like taking image[:, :, channel] of
+    cv2.imread(file_path, cv2.IMREAD_UNCHANGED). The file is streamed through and
+    only the one band is kept, so a third of the memory of the full image is used.
+    An image with one band is returned as it is.
+
+    Returns:
+    numpy.ndarray or None: The channel, or None if the image could not be loaded.
+    '''
+    try:
+        image = pyvips.Image.new_from_file(file_path, access='sequential')
+    except pyvips.Error:
+        return None
+    if image.bands in (3, 4) and channel < 3:
+        # pyvips keeps the bands as RGB(A) and OpenCV as BGR(A)
+        channel = 2 - channel
+    if image.bands > 1:
+        image = image.extract_band(channel)
+    return to_numpy(image)[:, :, 0]
+
+def edge_profiles(file_path):
+    '''
+    Calculates the edge profiles of the BF image used by the automatic calibration
+    (see auto_calibrate_grid in PitsCellebilleder.py) in a single streaming pass
+    through the file, so the image is never held in memory.
+
+    Returns:
+    tuple: (profile_x, profile_y) for lattice_from_edge_profiles
+    '''
+    image = pyvips.Image.new_from_file(file_path, access='sequential')
+    if image.bands >= 3:
+        gray = image[0] * 0.299 + image[1] * 0.587 + image[2] * 0.114
+    else:
+        gray = image[0].cast('float')
+    w, h = gray.width, gray.height
+
+    # Difference to the neighbouring column and row, both cut to the same size
+    difference_x = (gray.crop(1, 1, w - 1, h - 1) - gray.crop(0, 1, w - 1, h - 1)).abs()
+    difference_y = (gray.crop(1, 1, w - 1, h - 1) - gray.crop(1, 0, w - 1, h - 1)).abs()
+    columns, rows = difference_x.bandjoin(difference_y).project()
+
+    profile_x = np.ndarray(buffer=columns.write_to_memory(), dtype=_numpy_dtypes[columns.format],
+                           shape=[w - 1, 2])[:, 0]
+    profile_y = np.ndarray(buffer=rows.write_to_memory(), dtype=_numpy_dtypes[rows.format],
+                           shape=[h - 1, 2])[:, 1]
+    # A field starting at position i gives a peak at i
+    return np.concatenate([[0.0], profile_x]), np.concatenate([[0.0], profile_y])
+
+def read_field_windows(file_path, all_corners, square_size):
+    '''
+    Reads only the fields of an image. Returns a dictionary with the top left
+    corner of each field as key and the BGR field as value.
+    '''
+    image = open_tiled(file_path)
+    return {(x, y): read_region(image, x, y, square_size, square_size) for (x, y) in all_corners}
+
+def count_cells_in_fields_tiled(UV_file_path, all_corners, square_size, hsv_lower=hsv_lower, hsv_upper=hsv_upper,
+                                parameters=None, grayscale=False, channel=None):
+    '''
+    Same as count_cells_in_fields in PitsCellebilleder.py, but reads one field at a
+    time from the file instead of taking the full UV image. grayscale and channel
+    work as in read_UV_image.
+    '''
+    image = open_tiled(UV_file_path)
+    cell_counts = {}
+    for (x, y) in all_corners:
+        square = read_region(image, x, y, square_size, square_size)
+        if grayscale and square.ndim == 3:
+            if channel is None:
+                square = cv2.cvtColor(square, cv2.COLOR_BGR2GRAY)
+            else:
+                square = np.ascontiguousarray(square[:, :, channel])
+        cell_counts[(x, y)] = count_cells_in_square_hsv(square, hsv_lower, hsv_upper, parameters)
+    return cell_counts